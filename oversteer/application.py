@@ -1,15 +1,27 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from locale import gettext as _
 import logging
 import os
 import subprocess
+import time
 from .device_manager import DeviceManager
+from .latency_stats import LatencyStats
 from .model import Model
-import sys
+from . import event_mask
+from . import telemetry
 from xdg.BaseDirectory import save_config_path
 
 class Application:
 
+    # Devices a profile is applied to at the same time with --all or several --device
+    apply_workers = 8
+
+    # Options that select devices or change how Oversteer runs, the GUI starts unless
+    # some other option is given. Axis responses only apply while the GUI runs.
+    run_options = ['device', 'all', 'gui', 'debug', 'version', 'io_watch', 'record', 'replay', 'replay_speed',
+            'telemetry'] + [axis + '_response' for axis in Model.response_axes]
+
     def __init__(self, version, pkgdatadir, icondir):
         self.version = version
         self.datadir = pkgdatadir
@@ -25,7 +37,9 @@ class Application:
     def run(self, argv):
         parser = argparse.ArgumentParser(prog=argv[0], description=_("Oversteer - Steering Wheel Manager"))
         parser.add_argument('command', nargs='*', help=_("Run as command's companion"))
-        parser.add_argument('--device', help=_("Device path"))
+        parser.add_argument('--device', action='append',
+                help=_("Device path, can be repeated to apply to several devices"))
+        parser.add_argument('--all', action='store_true', help=_("apply to all the connected devices"))
         parser.add_argument('--list', action='store_true', help=_("list connected devices"))
         parser.add_argument('--mode', help=_("set the compatibility mode"))
         parser.add_argument('--range', type=int, help=_("set the rotation range [40-900]"))
@@ -44,26 +58,48 @@ class Application:
                 help=_("don't run command manually"))
         parser.add_argument('-p', '--profile', help=_("load settings from a profile"))
         parser.add_argument('-g', '--gui', action='store_true', help=_("start the GUI"))
+        parser.add_argument('--input-stats', type=float, dest='input_stats', metavar='SECONDS',
+                help=_("read input events for some seconds and show polling rate statistics"))
+        parser.add_argument('--mode-switch-benchmark', type=int, dest='mode_switch_benchmark', metavar='COUNT',
+                help=_("switch between the current and the --mode compatibility mode and show how long the device "
+                    "takes to be usable"))
+        parser.add_argument('--record', metavar='FILE', help=_("record the input events of the selected device"))
+        parser.add_argument('--telemetry', nargs='?', const=telemetry.default_path, metavar='PATH',
+                help=_("publish live input state of the selected device to shared memory"))
+        parser.add_argument('--replay', action='append', metavar='FILE',
+                help=_("add a device that replays a recorded input file"))
+        parser.add_argument('--replay-speed', type=float, default=1.0, dest='replay_speed',
+                help=_("replay speed multiplier, 0 replays as fast as possible"))
+        parser.add_argument('--io-watch', action='store_true', dest='io_watch',
+                help=_("read input events from the GUI main loop instead of a thread"))
+        for axis in Model.response_axes:
+            parser.add_argument('--{}-response'.format(axis), type=self.parse_response, dest=axis + '_response',
+                    metavar='DEADZONE,CURVE' + (',INVERT' if axis != 'steering' else ''),
+                    help=_("process the {} axis on a virtual device (deadzone %, curve exponent %)").format(axis))
         parser.add_argument('--debug', action='store_true', help=_("enable debug output"))
         parser.add_argument('--version', action='store_true', help=_("show version"))
 
         args = parser.parse_args(argv[1:])
-        argc = len(sys.argv[1:])
 
         if args.version:
             print("Oversteer v" + self.version)
             exit(0)
 
-        if args.debug:
-            argc -= 1
-        else:
+        if not args.debug:
             logging.disable(level=logging.INFO)
 
         self.device_manager = DeviceManager()
         self.device_manager.start()
 
+        if args.replay is not None:
+            for path in args.replay:
+                try:
+                    self.device_manager.add_replay_device(path, args.replay_speed)
+                except (OSError, ValueError) as e:
+                    print(_("Can't replay {}: {}").format(path, str(e)))
+                    exit(-1)
+
         if args.list:
-            argc -= 1
             devices = self.device_manager.get_devices()
             print(_("Devices found:"))
             for device in devices:
@@ -76,17 +112,36 @@ class Application:
                 print(_("This profile doesn't exist."))
                 exit(-1)
 
-        if args.device is not None:
-            argc -= 1
+        actions = [name for name, value in vars(args).items()
+                if name not in self.run_options and value is not None and value is not False and value != []]
+        start_gui = args.gui or not actions
+        multiple = args.all or (args.device is not None and len(args.device) > 1)
 
-        start_gui = args.gui or argc == 0
+        devices = []
+        if args.all:
+            devices = [device for device in self.device_manager.get_devices() if device.is_ready()]
+        elif args.device is not None:
+            for path in args.device:
+                device = None
+                if os.path.exists(path):
+                    device = self.device_manager.get_device(os.path.realpath(path))
+                if device is None:
+                    print(_("Device {} not found.").format(path))
+                else:
+                    devices.append(device)
+        elif self.device_manager.first_device() is not None:
+            devices = [self.device_manager.first_device()]
+        device = devices[0] if devices else None
 
-        device = None
-        if args.device is not None:
-            if os.path.exists(args.device):
-                device = self.device_manager.get_device(os.path.realpath(args.device))
-        else:
-            device = self.device_manager.first_device()
+        if not start_gui and multiple:
+            if not devices:
+                print(_("No device available."))
+                exit(-1)
+            if not self.apply_to_devices(devices, args):
+                exit(-1)
+            if args.command:
+                subprocess.Popen(args.command, shell=True)
+            return
 
         if not start_gui and device and not device.check_permissions():
             if self.udev_path:
@@ -100,8 +155,37 @@ class Application:
         if not device:
             print(_("No device available."))
 
-        model = Model(device)
+        if args.input_stats is not None:
+            if not device:
+                exit(-1)
+            self.print_input_stats(device, args.input_stats)
+            exit(0)
+
+        if args.mode_switch_benchmark is not None:
+            if not device or args.mode is None:
+                exit(-1)
+            self.benchmark_mode_switch(device, args.mode, args.mode_switch_benchmark)
+            exit(0)
+
+        if start_gui:
+            model = Model(device)
+            self.apply_settings(model, args)
+            self.args = args
+            from oversteer.gui import Gui
+            Gui(self, model, argv)
+            return
 
+        # As in apply_to_device, the settings are merged first so flush_device plans them in order
+        model = Model()
+        self.apply_settings(model, args)
+        if device:
+            model.set_device(device)
+            model.flush_device()
+            self.print_gui_only_settings(device, model)
+        if args.command:
+            subprocess.Popen(args.command, shell=True)
+
+    def apply_settings(self, model, args):
         if args.profile is not None:
             profile_file = os.path.join(self.profile_path, args.profile + '.ini')
             model.load(profile_file)
@@ -125,14 +209,94 @@ class Application:
             model.set_ffb_leds(1 if args.ffb_leds else 0)
         if args.center_wheel is not None:
             model.set_center_wheel(1 if args.center_wheel else 0)
+        for axis in Model.response_axes:
+            if getattr(args, axis + '_response') is not None:
+                model.set_axis_response(axis, getattr(args, axis + '_response'))
 
-        if start_gui:
-            self.args = args
-            from oversteer.gui import Gui
-            Gui(self, model, argv)
-            return
+    def apply_to_device(self, device, args):
+        # Runs on a pool thread, the device writes stay in order on its own command queue
+        start_time = time.monotonic()
+        if not device.check_permissions():
+            return _("no permissions"), [], time.monotonic() - start_time
+        # The settings are merged before the device is set so flush_device plans every write
+        model = Model()
+        self.apply_settings(model, args)
+        model.set_device(device)
+        steps = model.flush_device()
+        self.print_gui_only_settings(device, model)
+        return _("ok"), steps, time.monotonic() - start_time
 
-        model.flush_device()
-        if args.command:
-            subprocess.Popen(args.command, shell=True)
+    def print_gui_only_settings(self, device, model):
+        if model.get_combine_pedals() and not device.get_descriptor().has_attribute('combine_pedals'):
+            print(_("The driver of {} can't combine pedals, they're only combined while the GUI runs.")
+                    .format(device.name))
+
+    def apply_to_devices(self, devices, args):
+        start_time = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(len(devices), self.apply_workers)) as executor:
+            # Names are taken first, a mode change disables the device
+            futures = [(device.dev_name, device.name, executor.submit(self.apply_to_device, device, args))
+                    for device in devices]
+        elapsed = time.monotonic() - start_time
+
+        succeeded = True
+        print("{:<20} {:<32} {:<16} {:>6} {:>9}".format(_("Device"), _("Name"), _("Result"), _("Writes"), _("Time")))
+        for dev_name, name, future in futures:
+            try:
+                result, steps, seconds = future.result()
+            except Exception as e:
+                result, steps, seconds = str(e), [], None
+            if result != _("ok"):
+                succeeded = False
+            writes = sum(1 for step, step_seconds in steps if step != 'snapshot')
+            print("{:<20} {:<32} {:<16} {:>6} {:>9}".format(str(dev_name), name[:32], result[:16], writes,
+                    "{:.2f} s".format(seconds) if seconds is not None else "-"))
+        print(_("Applied to {} devices in {:.2f} s").format(len(devices), elapsed))
+        return succeeded
+
+    def parse_response(self, value):
+        try:
+            return tuple(map(int, value.split(',')))
+        except ValueError:
+            raise argparse.ArgumentTypeError(_("expected comma separated integers"))
+
+    def benchmark_mode_switch(self, device, mode, count):
+        modes = [device.get_mode(), mode]
+        if modes[0] == mode:
+            print(_("The device is already in {} mode.").format(mode))
+            exit(-1)
+        switch_times = LatencyStats(0.01, 1001)
+        for i in range(count):
+            target = modes[(i + 1) % 2]
+            if not device.set_mode(target):
+                print(_("{} didn't come back after switching to {}.").format(device.name, target))
+                exit(-1)
+            switch_time = device.get_mode_switch_time()
+            switch_times.record(switch_time)
+            print("  {} -> {}: {:.3f} s".format(modes[i % 2], target, switch_time))
+            # The wheel usually comes back as a new device
+            if device.get_successor() is not None:
+                device = device.get_successor()
+        print(_("Mode write to usable device: {}").format(switch_times.format_report()))
 
+    def print_input_stats(self, device, duration):
+        input_stats = device.enable_input_stats()
+        print(_("Reading input events from {} for {} seconds...").format(device.name, duration))
+        # Toggle the main window event mask every second to compare the wakeups with and without it
+        masked = False
+        next_toggle = time.monotonic() + 1
+        end_time = time.monotonic() + duration
+        remaining = duration
+        while remaining > 0:
+            device.read_event_batch(min(remaining, max(next_toggle - time.monotonic(), 0)))
+            now = time.monotonic()
+            if now >= next_toggle:
+                masked = not masked
+                if masked:
+                    device.set_event_interest('input_stats', event_mask.default_interest)
+                else:
+                    device.clear_event_interest('input_stats')
+                next_toggle = now + 1
+            remaining = end_time - now
+        device.clear_event_interest('input_stats')
+        print(input_stats.format_report())
@@ -0,0 +1,180 @@
+from evdev import ecodes, AbsInfo, UInput
+import logging
+import numpy as np
+import os
+from threading import Lock
+import time
+from .event_buffer import EventBuffer
+from .latency_stats import LatencyStats
+
+#
+# Axis responses are set per axis name as (deadzone, curve[, invert]):
+#
+# - deadzone: percentage of the travel ignored around the center (steering) or at
+#   the rest position (pedals)
+# - curve: response exponent as a percentage, 100 is linear, higher values make the
+#   start of the travel less sensitive
+# - invert: pedals only, 1 reverses the pedal travel
+#
+# Every response is turned into a lookup table over the normalized axis range, so
+# processing costs one table lookup per event whatever the response is.
+#
+
+axes = {
+    'steering': ecodes.ABS_X,
+    'throttle': ecodes.ABS_Z,
+    'brakes': ecodes.ABS_RZ,
+    'clutch': ecodes.ABS_Y,
+}
+
+# Normalized axis ranges as produced by Device.normalize_event
+normalized_absinfo = {
+    ecodes.ABS_X: AbsInfo(32768, 0, 65535, 0, 0, 0),
+    ecodes.ABS_Y: AbsInfo(255, 0, 255, 0, 0, 0),
+    ecodes.ABS_Z: AbsInfo(255, 0, 255, 0, 0, 0),
+    ecodes.ABS_RZ: AbsInfo(255, 0, 255, 0, 0, 0),
+    ecodes.ABS_HAT0X: AbsInfo(0, -1, 1, 0, 0, 0),
+    ecodes.ABS_HAT0Y: AbsInfo(0, -1, 1, 0, 0, 0),
+}
+
+def shape(travel, deadzone, curve):
+    deadzone = min(max(deadzone, 0), 99) / 100
+    curve = max(curve, 10) / 100
+    return np.clip((travel - deadzone) / (1 - deadzone), 0, 1) ** curve
+
+def steering_table(deadzone, curve):
+    position = np.arange(65536) - 32768
+    # Both sides reach their end of travel, there's one step less to the right
+    travel = np.where(position < 0, 32768, 32767)
+    shaped = np.sign(position) * shape(np.abs(position) / travel, deadzone, curve)
+    return np.rint(32768 + shaped * travel).astype(np.int32)
+
+def pedal_table(deadzone, curve, invert = 0):
+    # Pedals rest at 255 and go down to 0 when fully pressed
+    shaped = shape((255 - np.arange(256)) / 255, deadzone, curve)
+    if invert:
+        shaped = 1 - shaped
+    return np.rint(255 - shaped * 255).astype(np.int32)
+
+def build_table(code, response):
+    if code == ecodes.ABS_X:
+        return steering_table(*response[:2])
+    return pedal_table(*response[:3])
+
+class UInputSink:
+
+    def __init__(self, device):
+        input_device = device.get_input_device()
+        capabilities = input_device.capabilities(absinfo=True)
+        keys = set()
+        for code in capabilities.get(ecodes.EV_KEY, []):
+            keys.add(device.event_map.get((ecodes.EV_KEY, code), (code,))[0])
+        absinfo = {}
+        for code, info in capabilities.get(ecodes.EV_ABS, []):
+            code = device.event_map.get((ecodes.EV_ABS, code), (code,))[0]
+            absinfo[code] = normalized_absinfo.get(code, info)
+        events = {ecodes.EV_ABS: sorted(absinfo.items())}
+        if keys:
+            events[ecodes.EV_KEY] = sorted(keys)
+        info = getattr(input_device, 'info', None)
+        self.uinput = UInput(events, name='Oversteer ' + device.name, bustype=ecodes.BUS_USB,
+                vendor=int(device.vendor_id, 16), product=int(device.product_id, 16),
+                version=info.version if info is not None else 1)
+        logging.debug("Created virtual device %s for %s", self.uinput.device.path, device.name)
+
+    def emit(self, events):
+        # The events are struct input_event records, uinput takes the whole batch in one write
+        os.write(self.uinput.fd, events.data)
+
+    def close(self):
+        self.uinput.close()
+
+class BufferSink:
+
+    def __init__(self, device = None):
+        self.data = bytearray()
+
+    def emit(self, events):
+        self.data += events.data
+
+    def get_events(self):
+        return np.frombuffer(self.data, dtype=EventBuffer.dtype)
+
+    def close(self):
+        pass
+
+class AxisProcessor:
+
+    # Time allowed to process and emit a read before it counts as an overrun
+    latency_budget = 0.0002
+
+    def __init__(self, responses, sink):
+        self.sink = sink
+        self.lock = Lock()
+        self.muted = False
+        self.buffer = np.zeros(256, dtype=EventBuffer.dtype)
+        self.latency = LatencyStats(0.000001, 1001)
+        self.overruns = 0
+        self.events = 0
+        self.configure(responses)
+
+    def configure(self, responses):
+        self.tables = {axes[axis]: build_table(axes[axis], response) for axis, response in responses.items()}
+
+    def set_muted(self, muted):
+        self.muted = muted
+
+    def is_muted(self):
+        return self.muted
+
+    def process_batch(self, events):
+        if self.muted or len(events) == 0:
+            return
+        start_time = time.perf_counter()
+        if len(events) > len(self.buffer):
+            self.buffer = np.zeros(len(events), dtype=EventBuffer.dtype)
+        tables = self.tables
+        output = self.buffer[:len(events)]
+        output[...] = events
+        axis_events = output['type'] == ecodes.EV_ABS
+        codes = output['code']
+        values = output['value']
+        for code, table in tables.items():
+            selected = axis_events & (codes == code)
+            if selected.any():
+                values[selected] = table[np.clip(values[selected], 0, len(table) - 1)]
+        with self.lock:
+            if self.sink is None:
+                return
+            self.sink.emit(output)
+        elapsed = time.perf_counter() - start_time
+        self.latency.record(elapsed)
+        self.events += len(events)
+        if elapsed > self.latency_budget:
+            self.overruns += 1
+            if self.overruns & (self.overruns - 1) == 0:
+                logging.warning("Axis processing over budget: %.0f us for %d events (%d overruns)",
+                        elapsed * 1000000, len(events), self.overruns)
+
+    def get_report(self):
+        return {
+            'events': self.events,
+            'overruns': self.overruns,
+            'budget': self.latency_budget,
+            'latency': self.latency.get_report(),
+        }
+
+    def format_report(self):
+        report = self.get_report()
+        latency = report['latency']
+        if latency is None:
+            return "no events"
+        return "{} events, {} reads, mean {:.0f} us, p99 {:.0f} us, max {:.0f} us, {} over {:.0f} us budget".format(
+                report['events'], latency['count'], latency['mean'] * 1000000, latency['p99'] * 1000000,
+                latency['max'] * 1000000, report['overruns'], report['budget'] * 1000000)
+
+    def close(self):
+        with self.lock:
+            if self.sink is not None:
+                self.sink.close()
+                self.sink = None
@@ -0,0 +1,33 @@
+from evdev import ecodes
+import numpy as np
+
+class AxisState:
+
+    def __init__(self):
+        self.values = np.zeros(ecodes.ABS_CNT, dtype=np.int32)
+        self.timestamps = np.zeros(ecodes.ABS_CNT, dtype=np.float64)
+
+    def reset(self):
+        self.values.fill(0)
+        self.timestamps.fill(0)
+
+    def get_value(self, code):
+        return int(self.values[code])
+
+    def get_timestamp(self, code):
+        return float(self.timestamps[code])
+
+    def update(self, code, value, timestamp):
+        self.values[code] = value
+        self.timestamps[code] = timestamp
+
+    def update_batch(self, events):
+        events = events[events['type'] == ecodes.EV_ABS]
+        if len(events) == 0:
+            return
+        # Keep only the last event for each axis
+        events = events[::-1]
+        codes, indexes = np.unique(events['code'], return_index=True)
+        events = events[indexes]
+        self.values[codes] = events['value']
+        self.timestamps[codes] = events['sec'] + events['usec'] / 1000000
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import logging
+from threading import Condition, Thread, current_thread
+import time
+from .latency_stats import LatencyStats
+
+class CommandQueue:
+
+    # Command latencies are counted in 1 ms bins up to 10 s, mode changes can take seconds
+    latency_bin_size = 0.001
+    latency_bin_count = 10001
+
+    def __init__(self, name):
+        self.name = name
+        self.condition = Condition()
+        self.pending = OrderedDict()
+        self.running = None
+        self.thread = None
+        self.max_depth = 0
+        self.coalesced = 0
+        self.latency = {}
+        self.sequence = 0
+
+    def submit(self, key, function, *args):
+        # Commands with the same key replace the pending one and its futures get the
+        # result of the latest, a key of None is never coalesced
+        future = Future()
+        with self.condition:
+            name = key
+            if key is None:
+                self.sequence += 1
+                name = 'other'
+                key = (name, self.sequence)
+            futures = [future]
+            if key in self.pending:
+                futures = self.pending.pop(key)[3] + futures
+                self.coalesced += 1
+            self.pending[key] = (name, function, args, futures, time.monotonic())
+            self.max_depth = max(self.max_depth, len(self.pending))
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        return future
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                key, (name, function, args, futures, submit_time) = self.pending.popitem(last=False)
+                self.running = key
+            try:
+                result = function(*args)
+            except Exception as e:
+                logging.warning("Command %s on %s failed: %s", name, self.name, e)
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future in futures:
+                    future.set_result(result)
+            with self.condition:
+                if name not in self.latency:
+                    self.latency[name] = LatencyStats(self.latency_bin_size, self.latency_bin_count)
+                self.latency[name].record(time.monotonic() - submit_time)
+                self.running = None
+                self.condition.notify_all()
+
+    def get_depth(self):
+        with self.condition:
+            return len(self.pending) + (self.running is not None)
+
+    def get_max_depth(self):
+        return self.max_depth
+
+    def get_latency(self):
+        with self.condition:
+            return dict(self.latency)
+
+    def join(self, timeout = None):
+        # A command waiting for the queue only needs the commands before it, which already ran
+        if current_thread() is self.thread:
+            return True
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and self.running is None, timeout)
+
+    def format_report(self):
+        lines = ["Depth: {} (max {}), coalesced: {}".format(self.get_depth(), self.max_depth, self.coalesced)]
+        for name, latency_stats in sorted(self.get_latency().items()):
+            lines.append("  {}: {}".format(name, latency_stats.format_report()))
+        return "\n".join(lines)
@@ -1,23 +1,43 @@
-from evdev import ecodes, InputDevice
+from evdev import ecodes, InputDevice, InputEvent, UInputError
+import fcntl
 import grp
 import logging
+import numpy as np
 import os
 import pwd
 import re
 import select
+import struct
+from threading import Condition, Lock
 import time
-from . import wheel_ids as wid
+from .axis_processor import AxisProcessor, UInputSink
+from .axis_state import AxisState
+from .command_queue import CommandQueue
+from .device_descriptor import DeviceDescriptor
+from .device_snapshot import DeviceSnapshot
+from .event_buffer import EventBuffer
+from . import event_mask
+from .input_stats import InputStats
+from .pedal_combiner import PedalCombiner
+from .recorder import Recorder
+from .telemetry import TelemetryPublisher
+from . import normalization
 
 logging.basicConfig(level=logging.DEBUG)
 
+# _IOW('E', 0xa0, int)
+EVIOCSCLOCKID = 0x400445a0
+
 class Device:
 
-    last_axis_value = {
-        ecodes.ABS_X: 0,
-        ecodes.ABS_Y: 0,
-        ecodes.ABS_Z: 0,
-        ecodes.ABS_RZ: 0,
-    }
+    # Syscalls an attribute read or write took before descriptors were kept open:
+    # access, open, read or write and close
+    attribute_syscalls = 4
+
+    # Time a re-enumerated device gets to become usable, and how often its node is
+    # probed meanwhile
+    ready_timeout = 10
+    ready_probe_interval = 0.01
 
     def __init__(self, device_manager, data):
         self.device_manager = device_manager
@@ -27,16 +47,43 @@ class Device:
         self.product_id = None
         self.usb_id = None
         self.dev_path = None
+        self.port_path = None
         self.dev_name = None
         self.name = None
         self.ready = True
+        self.ready_condition = Condition()
+        self.mode_switch_time = None
+        self.successor = None
         self.max_range = None
+        self.event_map = {}
+        self.event_table = None
+        self.event_buffer = None
+        self.axis_state = AxisState()
+        self.input_stats = None
+        self.recorder = None
+        self.telemetry = None
+        self.axis_responses = {}
+        self.axis_sink_factory = None
+        self.axis_processor = None
+        self.input_grabbed = False
+        self.pedal_combiner = None
+        self.event_interests = {}
+        self.event_mask = None
+        self.attribute_lock = Lock()
+        self.attribute_fds = {}
+        self.attribute_stats = {}
+        self.descriptor = None
+        self.command_queue = None
 
         self.set(data)
 
     def set(self, data):
+        if 'dev_path' in data and data['dev_path'] != self.dev_path:
+            self.close_attributes()
         for key, value in data.items():
             setattr(self, key, value)
+        if 'usb_id' in data or 'vendor_id' in data:
+            self.build_event_map()
 
     def close(self):
         if self.input_device is not None:
@@ -45,27 +92,129 @@ class Device:
 
     def disable(self):
         self.dev_name = None
-        self.ready = False
+        with self.ready_condition:
+            self.ready = False
+            self.successor = None
+        self.stop_axis_processing()
+        self.close_attributes()
         self.close()
 
     def enable(self):
         self.ready = True
+        self.update_axis_processing()
+        with self.ready_condition:
+            self.ready_condition.notify_all()
 
     def is_ready(self):
         return self.ready
 
+    def set_successor(self, device):
+        # A mode switch can bring the wheel back as a new device on the same port
+        with self.ready_condition:
+            self.successor = device
+            self.ready_condition.notify_all()
+
+    def get_successor(self):
+        return self.successor
+
+    def wait_ready(self, timeout = ready_timeout):
+        with self.ready_condition:
+            return self.ready_condition.wait_for(lambda: self.ready or self.successor is not None, timeout)
+
+    def probe_input_device(self):
+        # The event node is usable once it can be opened and answers a capability query
+        dev_name = self.dev_name
+        if dev_name is None:
+            return False
+        try:
+            input_device = InputDevice(dev_name)
+        except OSError:
+            return False
+        try:
+            input_device.capabilities()
+        except OSError:
+            return False
+        finally:
+            input_device.close()
+        return True
+
+    def wait_usable(self, timeout = ready_timeout):
+        deadline = time.monotonic() + timeout
+        while not self.probe_input_device():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.ready_probe_interval)
+        return True
+
     def get_id(self):
         return self.id
 
     def device_file(self, filename):
         return os.path.join(self.dev_path, filename)
 
+    def has_device_file(self, filename):
+        return self.dev_path is not None and os.access(self.device_file(filename), os.F_OK)
+
     def checked_device_file(self, filename):
         path = self.device_file(filename)
         if not os.access(path, os.F_OK | os.R_OK | os.W_OK):
             return False
         return path
 
+    def _attribute_fd(self, name):
+        # Missing attributes are cached too, as None
+        if name in self.attribute_fds:
+            return self.attribute_fds[name], 0
+        syscalls = 1
+        fd = None
+        path = self.checked_device_file(name)
+        if path:
+            fd = os.open(path, os.O_RDWR)
+            syscalls += 1
+        self.attribute_fds[name] = fd
+        return fd, syscalls
+
+    def _count_attribute_syscalls(self, name, operation, syscalls, legacy_syscalls):
+        stats = self.attribute_stats.setdefault((name, operation), [0, 0])
+        stats[0] += 1
+        stats[1] += legacy_syscalls - syscalls
+
+    def _attribute_io(self, name, operation, io):
+        with self.attribute_lock:
+            fd, syscalls = self._attribute_fd(name)
+            if fd is None:
+                self._count_attribute_syscalls(name, operation, syscalls, 1)
+                return None
+            try:
+                result = io(fd)
+            except OSError:
+                del self.attribute_fds[name]
+                os.close(fd)
+                raise
+            self._count_attribute_syscalls(name, operation, syscalls + 1, self.attribute_syscalls)
+            return result
+
+    def read_attribute(self, name):
+        data = self._attribute_io(name, 'read', lambda fd: os.pread(fd, 4096, 0))
+        if data is None:
+            return None
+        return data.decode().strip()
+
+    def write_attribute(self, name, value):
+        return self._attribute_io(name, 'write', lambda fd: os.pwrite(fd, value.encode(), 0)) is not None
+
+    def close_attributes(self):
+        with self.attribute_lock:
+            for fd in self.attribute_fds.values():
+                if fd is not None:
+                    os.close(fd)
+            self.attribute_fds = {}
+
+    def get_attribute_stats(self):
+        # Calls and syscalls saved per attribute and operation
+        with self.attribute_lock:
+            return {key: tuple(stats) for key, stats in self.attribute_stats.items()}
+
     def check_file_permissions(self, filename):
         if filename is None:
             return True
@@ -82,16 +231,61 @@ class Device:
     def get_max_range(self):
         return self.max_range
 
+    def get_descriptor(self):
+        if self.descriptor is None:
+            self.refresh_descriptor()
+        return self.descriptor
+
+    def refresh_descriptor(self):
+        # Attributes cached as missing may have appeared or become writable since
+        self.close_attributes()
+        self.descriptor = DeviceDescriptor(self)
+        return self.descriptor
+
+    def snapshot(self):
+        # Every setting read once, alternate_modes gives both the mode and the mode list
+        modes = None
+        mode = None
+        data = self.read_attribute("alternate_modes")
+        if data is not None:
+            modes, mode = self.parse_modes(data)
+            modes = tuple(tuple(item) for item in modes)
+        return DeviceSnapshot(
+            mode=mode,
+            modes=modes,
+            range=self.get_range(),
+            ff_gain=self.get_ff_gain(),
+            autocenter=self.get_autocenter(),
+            combine_pedals=self.get_combine_pedals(),
+            spring_level=self.get_spring_level(),
+            damper_level=self.get_damper_level(),
+            friction_level=self.get_friction_level(),
+            ffb_leds=self.get_ffb_leds(),
+            peak_ffb_level=self.get_peak_ffb_level(),
+        )
+
     def list_modes(self):
-        path = self.checked_device_file("alternate_modes")
-        if not path:
+        return self.get_descriptor().modes
+
+    def read_modes(self):
+        data = self.read_attribute("alternate_modes")
+        if data is None:
+            return None
+        return self.parse_modes(data)[0]
+
+    def get_mode(self):
+        data = self.read_attribute("alternate_modes")
+        if data is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        lines = data.splitlines()
+        return self.parse_modes(data)[1]
+
+    def parse_modes(self, data):
+        # Returns the alternate modes and the current mode id
         reg = re.compile("([^:]+): (.*)")
         alternate_modes = []
-        for line in lines:
+        current_mode = None
+        mode_id = None
+        for line in data.splitlines():
             matches = reg.match(line)
             mode_id = matches.group(1)
             if mode_id == "native":
@@ -100,30 +294,14 @@ class Device:
             if name.endswith("*"):
                 name = name[:-2]
                 selected = True
+                if current_mode is None:
+                    current_mode = mode_id
             else:
                 selected = False
             alternate_modes.append([mode_id, name, selected])
-        return alternate_modes
-
-    def get_mode(self):
-        path = self.checked_device_file("alternate_modes")
-        if not path:
-            return None
-        with open(path, "r") as file:
-            data = file.read()
-
-        mode_id = None
-        lines = data.splitlines()
-        reg = re.compile("([^:]+): (.*)")
-        for line in lines:
-            matches = reg.match(line)
-            mode_id = matches.group(1)
-            if mode_id == "native":
-                continue
-            name = matches.group(2)
-            if name.endswith("*"):
-                return mode_id
-        return mode_id
+        if current_mode is None:
+            current_mode = mode_id
+        return alternate_modes, current_mode
 
     def set_mode(self, emulation_mode):
         path = self.checked_device_file("alternate_modes")
@@ -134,64 +312,74 @@ class Device:
             return True
         self.disable()
         logging.debug("Setting mode: %s", str(emulation_mode))
+        start_time = time.monotonic()
         with open(path, "w") as file:
             file.write(emulation_mode)
-        # Wait for device ready
-        for i in range(10):
-            if self.is_ready():
-                return True
-            time.sleep(1)
-        return False
+        # The device manager enables the device once its new event node is usable
+        if not self.wait_ready():
+            logging.warning("%s not ready %d s after switching to %s", self.name, self.ready_timeout, emulation_mode)
+            return False
+        self.mode_switch_time = time.monotonic() - start_time
+        logging.debug("%s usable %.3f s after switching to %s", self.name, self.mode_switch_time, emulation_mode)
+        return True
+
+    def get_mode_switch_time(self):
+        return self.mode_switch_time
 
     def get_range(self):
-        path = self.checked_device_file("range")
-        if not path:
+        wrange = self.read_attribute("range")
+        if wrange is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        wrange = data.strip()
         return int(wrange)
 
     def set_range(self, wrange):
-        path = self.checked_device_file("range")
-        if not path:
-            return False
         wrange = str(wrange)
         logging.debug("Setting range: %s", wrange)
-        with open(path, "w") as file:
-            file.write(wrange)
-        return True
+        return self.write_attribute("range", wrange)
 
     def get_combine_pedals(self):
-        path = self.checked_device_file("combine_pedals")
-        if not path:
-            return None
-        with open(path, "r") as file:
-            data = file.read()
-        combine_pedals = data.strip()
+        combine_pedals = self.read_attribute("combine_pedals")
+        if combine_pedals is None:
+            if self.get_descriptor().has_attribute("combine_pedals"):
+                return None
+            return self.pedal_combiner.get_mode() if self.pedal_combiner is not None else 0
         return int(combine_pedals)
 
     def set_combine_pedals(self, combine_pedals):
-        path = self.checked_device_file("combine_pedals")
-        if not path:
-            return False
+        descriptor = self.get_descriptor()
+        if not descriptor.is_writable("combine_pedals"):
+            if descriptor.has_attribute("combine_pedals"):
+                return False
+            return self.set_software_combine_pedals(int(combine_pedals))
         combine_pedals = str(combine_pedals)
         logging.debug("Setting combined pedals: %s", combine_pedals)
-        with open(path, "w") as file:
-            file.write(combine_pedals)
+        return self.write_attribute("combine_pedals", combine_pedals)
+
+    def set_software_combine_pedals(self, combine_pedals):
+        if combine_pedals != 0 and combine_pedals not in PedalCombiner.pedals:
+            return False
+        logging.debug("Setting software combined pedals: %s", combine_pedals)
+        if combine_pedals == 0:
+            self.pedal_combiner = None
+            self.update_event_mask()
+            return True
+        # The pedals are combined as events are read, it only lasts while something reads them
+        if not self.event_interests:
+            logging.warning("Can't combine the pedals of %s, no input is being read", self.name)
+            return False
+        pedal_combiner = PedalCombiner(combine_pedals)
+        self.axis_state.update(pedal_combiner.get_pedal(), PedalCombiner.merged_value, EventBuffer.now())
+        self.pedal_combiner = pedal_combiner
+        self.update_event_mask()
         return True
 
     def get_autocenter(self):
-        path = self.checked_device_file("autocenter")
-        if not path:
-            capabilities = self.get_capabilities()
-            if ecodes.EV_FF in capabilities and ecodes.FF_AUTOCENTER in capabilities[ecodes.EV_FF]:
+        autocenter = self.read_attribute("autocenter")
+        if autocenter is None:
+            if self.get_descriptor().has_ff_effect(ecodes.FF_AUTOCENTER):
                 return 0
             else:
                 return None
-        with open(path, "r") as file:
-            data = file.read()
-        autocenter = data.strip()
         return int(round((int(autocenter) * 100) / 65535))
 
     def set_autocenter(self, autocenter):
@@ -199,26 +387,18 @@ class Device:
             autocenter = 100
         autocenter = str(int(autocenter / 100.0 * 65535))
         logging.debug("Setting autocenter strength: %s", autocenter)
-        path = self.checked_device_file("autocenter")
-        if path:
-            with open(path, "w") as file:
-                file.write(autocenter)
-        else:
+        if not self.write_attribute("autocenter", autocenter):
             input_device = self.get_input_device()
             input_device.write(ecodes.EV_FF, ecodes.FF_AUTOCENTER, int(autocenter))
         return True
 
     def get_ff_gain(self):
-        path = self.checked_device_file("gain")
-        if not path:
-            capabilities = self.get_capabilities()
-            if ecodes.EV_FF in capabilities and ecodes.FF_GAIN in capabilities[ecodes.EV_FF]:
+        gain = self.read_attribute("gain")
+        if gain is None:
+            if self.get_descriptor().has_ff_effect(ecodes.FF_GAIN):
                 return 100
             else:
                 return None
-        with open(path, "r") as file:
-            data = file.read()
-        gain = int(data.strip())
         return int(round((int(gain) * 100) / 65535))
 
     def set_ff_gain(self, gain):
@@ -226,115 +406,89 @@ class Device:
             gain = 100
         gain = str(int(gain / 100.0 * 65535))
         logging.debug("Setting FF gain: %s", gain)
-        path = self.checked_device_file("gain")
-        if path:
-            with open(path, "w") as file:
-                file.write(gain)
-        else:
+        if not self.write_attribute("gain", gain):
             input_device = self.get_input_device()
             input_device.write(ecodes.EV_FF, ecodes.FF_GAIN, int(gain))
 
     def get_spring_level(self):
-        path = self.checked_device_file("spring_level")
-        if not path:
+        spring_level = self.read_attribute("spring_level")
+        if spring_level is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        spring_level = data.strip()
         return int(spring_level)
 
     def set_spring_level(self, level):
-        path = self.checked_device_file("spring_level")
-        if not path:
-            return False
         level = str(level)
         logging.debug("Setting spring level: %s", level)
-        with open(path, "w") as file:
-            file.write(level)
-        return True
+        return self.write_attribute("spring_level", level)
 
     def get_damper_level(self):
-        path = self.checked_device_file("damper_level")
-        if not path:
+        damper_level = self.read_attribute("damper_level")
+        if damper_level is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        damper_level = data.strip()
         return int(damper_level)
 
     def set_damper_level(self, level):
-        path = self.checked_device_file("damper_level")
-        if not path:
-            return False
         level = str(level)
         logging.debug("Setting damper level: %s", level)
-        with open(path, "w") as file:
-            file.write(level)
-        return True
+        return self.write_attribute("damper_level", level)
 
     def get_friction_level(self):
-        path = self.checked_device_file("friction_level")
-        if not path:
+        friction_level = self.read_attribute("friction_level")
+        if friction_level is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        friction_level = data.strip()
         return int(friction_level)
 
     def set_friction_level(self, level):
-        path = self.checked_device_file("friction_level")
-        if not path:
-            return False
         level = str(level)
         logging.debug("Setting friction level: %s", level)
-        with open(path, "w") as file:
-            file.write(level)
-        return True
+        return self.write_attribute("friction_level", level)
 
     def get_ffb_leds(self):
-        path = self.checked_device_file("ffb_leds")
-        if not path:
+        ffb_leds = self.read_attribute("ffb_leds")
+        if ffb_leds is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        ffb_leds = data.strip()
         return int(ffb_leds)
 
     def set_ffb_leds(self, ffb_leds):
-        path = self.checked_device_file("ffb_leds")
-        if not path:
-            return False
         ffb_leds = str(ffb_leds)
         logging.debug("Setting FF leds: %s", ffb_leds)
-        with open(path, "w") as file:
-            file.write(ffb_leds)
-        return True
+        return self.write_attribute("ffb_leds", ffb_leds)
 
     def get_peak_ffb_level(self):
-        path = self.checked_device_file("peak_ffb_level")
-        if not path:
+        peak_ffb_level = self.read_attribute("peak_ffb_level")
+        if peak_ffb_level is None:
             return None
-        with open(path, "r") as file:
-            data = file.read()
-        peak_ffb_level = data.strip()
         return int(peak_ffb_level)
 
     def set_peak_ffb_level(self, peak_ffb_level):
-        path = self.checked_device_file("peak_ffb_level")
-        if not path:
-            return False
         peak_ffb_level = str(peak_ffb_level)
         logging.debug("Setting peak FF level: %s", peak_ffb_level)
-        with open(path, "w") as file:
-            file.write(peak_ffb_level)
-        return True
+        return self.write_attribute("peak_ffb_level", peak_ffb_level)
 
     def center_wheel(self):
         self.set_autocenter(100)
         time.sleep(1)
         self.set_autocenter(0)
 
+    def get_command_queue(self):
+        if self.command_queue is None:
+            self.command_queue = CommandQueue(self.name)
+        return self.command_queue
+
+    def submit(self, key, function, *args):
+        # Writes run in order on the device worker thread, a pending write to the same
+        # key is replaced by the latest one
+        return self.get_command_queue().submit(key, function, *args)
+
+    def wait_commands(self, timeout = None):
+        if self.command_queue is None:
+            return True
+        return self.command_queue.join(timeout)
+
     def check_permissions(self):
+        return self.get_descriptor().permissions
+
+    def read_permissions(self):
         logging.debug("check_permissions: %s", self.dev_path)
         if not os.access(self.dev_path, os.F_OK | os.R_OK | os.X_OK):
             return False
@@ -361,102 +515,259 @@ class Device:
         return True
 
     def get_last_axis_value(self, axis):
-        return self.last_axis_value[axis]
+        return self.axis_state.get_value(axis)
+
+    def get_last_axis_timestamp(self, axis):
+        return self.axis_state.get_timestamp(axis)
+
+    def sync_axis_state(self):
+        input_device = self.get_input_device()
+        if input_device is None or input_device.fd == -1:
+            return False
+        sec, usec = divmod(EventBuffer.now_us(), 1000000)
+        timestamp = sec + usec / 1000000
+        # Capabilities are queried with EVIOCGABS, so absinfo holds the current axis values
+        for code, absinfo in input_device.capabilities(absinfo=True).get(ecodes.EV_ABS, []):
+            event = self.normalize_event(InputEvent(sec, usec, ecodes.EV_ABS, code, absinfo.value))
+            if self.pedal_combiner is not None:
+                event = self.pedal_combiner.combine_event(event)
+            self.axis_state.update(event.code, event.value, timestamp)
+        return True
 
     def get_input_device(self):
         if self.input_device is None or self.input_device.fd == -1:
-            if os.access(self.dev_name, os.R_OK):
+            if self.dev_name is not None and os.access(self.dev_name, os.R_OK):
                 self.input_device = InputDevice(self.dev_name)
+                self.set_clock()
+                self.update_event_mask()
         return self.input_device
 
+    def set_clock(self):
+        try:
+            fcntl.ioctl(self.input_device.fd, EVIOCSCLOCKID, struct.pack('i', EventBuffer.clock))
+        except OSError as e:
+            logging.warning("Can't set the event clock of %s, timestamps won't be comparable: %s", self.name, e)
+            return False
+        return True
+
+    def set_event_interest(self, consumer, interest):
+        self.event_interests[consumer] = interest
+        return self.update_event_mask()
+
+    def clear_event_interest(self, consumer):
+        if self.event_interests.pop(consumer, False) is not False:
+            return self.update_event_mask()
+        return True
+
+    def is_event_masked(self):
+        return self.event_mask is not None and any(codes is not None for codes in self.event_mask.values())
+
+    def raw_event_codes(self, event_type, codes):
+        # Masks apply to the codes sent by the device, before normalization
+        raw_codes = set(code for code in codes if (event_type, code) not in self.event_map)
+        for (raw_type, raw_code), (code, _, _) in self.event_map.items():
+            if raw_type == event_type and code in codes:
+                raw_codes.add(raw_code)
+        if self.pedal_combiner is not None and ecodes.ABS_Z in codes and event_type == ecodes.EV_ABS:
+            raw_codes.update(self.raw_event_codes(event_type, {self.pedal_combiner.get_pedal()}))
+        return raw_codes
+
+    def update_event_mask(self):
+        # Without consumers nothing is filtered
+        input_device = self.input_device
+        if input_device is None or input_device.fd == -1:
+            return False
+        if self.event_interests:
+            mask = event_mask.merge_interests(self.event_interests.values())
+        else:
+            mask = event_mask.merge_interests([None])
+        try:
+            for event_type, codes in mask.items():
+                if codes is not None:
+                    codes = self.raw_event_codes(event_type, codes)
+                event_mask.set_event_mask(input_device.fd, event_type, codes)
+        except OSError as e:
+            logging.debug("Can't set the event mask of %s: %s", self.name, e)
+            return False
+        self.event_mask = mask
+        if self.input_stats is not None:
+            self.input_stats.set_masked(self.is_event_masked())
+        logging.debug("Event mask of %s: %s", self.name, mask)
+        return True
+
+    def enable_input_stats(self):
+        if self.input_stats is None:
+            self.input_stats = InputStats()
+            self.input_stats.set_masked(self.is_event_masked())
+        return self.input_stats
+
+    def disable_input_stats(self):
+        self.input_stats = None
+
+    def get_input_stats(self):
+        return self.input_stats
+
+    def start_recording(self, path):
+        self.stop_recording()
+        logging.debug("Recording %s to %s", self.name, path)
+        self.recorder = Recorder(path, self)
+        self.set_event_interest('recorder', None)
+        return self.recorder
+
+    def stop_recording(self):
+        recorder = self.recorder
+        if recorder is not None:
+            self.recorder = None
+            self.clear_event_interest('recorder')
+            recorder.close()
+            logging.debug("Recorded %d events to %s", recorder.get_count(), recorder.get_path())
+
+    def get_recorder(self):
+        return self.recorder
+
+    def start_telemetry(self, path):
+        self.stop_telemetry()
+        logging.debug("Publishing %s telemetry to %s", self.name, path)
+        telemetry = TelemetryPublisher(path)
+        telemetry.publish(self.axis_state.values, np.zeros(0, dtype=EventBuffer.dtype))
+        self.telemetry = telemetry
+        self.set_event_interest('telemetry', event_mask.forward_interest)
+        return telemetry
+
+    def stop_telemetry(self):
+        telemetry = self.telemetry
+        if telemetry is not None:
+            self.telemetry = None
+            self.clear_event_interest('telemetry')
+            telemetry.close()
+
+    def get_telemetry(self):
+        return self.telemetry
+
+    def grab_input(self, grabbed):
+        # While axes are processed the device stays grabbed and the virtual device is muted instead
+        self.input_grabbed = grabbed
+        if self.axis_processor is not None:
+            self.axis_processor.set_muted(grabbed)
+            return
+        input_device = self.get_input_device()
+        if grabbed:
+            input_device.grab()
+        else:
+            input_device.ungrab()
+
+    def is_input_grabbed(self):
+        return self.input_grabbed
+
+    def set_axis_responses(self, responses):
+        self.axis_responses = {axis: tuple(response) for axis, response in responses.items() if response is not None}
+        return self.update_axis_processing()
+
+    def get_axis_response(self, axis):
+        return self.axis_responses.get(axis)
+
+    def enable_axis_processing(self, sink_factory = UInputSink):
+        self.axis_sink_factory = sink_factory
+        return self.update_axis_processing()
+
+    def disable_axis_processing(self):
+        self.axis_sink_factory = None
+        self.stop_axis_processing()
+
+    def get_axis_processor(self):
+        return self.axis_processor
+
+    def update_axis_processing(self):
+        if self.axis_sink_factory is None or not self.axis_responses or not self.ready:
+            self.stop_axis_processing()
+            return False
+        if self.axis_processor is not None:
+            self.axis_processor.configure(self.axis_responses)
+            return True
+        input_device = self.get_input_device()
+        if input_device is None:
+            return False
+        try:
+            sink = self.axis_sink_factory(self)
+        except (OSError, UInputError) as e:
+            logging.warning("Can't create a virtual device for %s: %s", self.name, e)
+            return False
+        processor = AxisProcessor(self.axis_responses, sink)
+        processor.set_muted(self.input_grabbed)
+        # Hide the physical device so games only see the processed axes
+        if not self.input_grabbed:
+            input_device.grab()
+        self.axis_processor = processor
+        self.set_event_interest('axis_processor', event_mask.forward_interest)
+        logging.debug("Processing %s axes: %s", self.name, self.axis_responses)
+        return True
+
+    def stop_axis_processing(self):
+        processor = self.axis_processor
+        if processor is None:
+            return
+        self.axis_processor = None
+        self.clear_event_interest('axis_processor')
+        processor.close()
+        input_device = self.input_device
+        if not self.input_grabbed and input_device is not None and input_device.fd != -1:
+            input_device.ungrab()
+        logging.debug("Axis processing stats (%s): %s", self.name, processor.format_report())
+
     def get_capabilities(self):
         return self.get_input_device().capabilities()
 
-    def read_events(self, timeout):
+    def read_event_batch(self, timeout):
         input_device = self.get_input_device()
-        if input_device is not None and input_device.fd != -1:
-            r, _, _ = select.select({input_device.fd: input_device}, [], [], timeout)
-            if input_device.fd in r:
-                for event in input_device.read():
-                    event = self.normalize_event(event)
-                    if event.type == ecodes.EV_ABS:
-                        self.last_axis_value[ecodes.ABS_X] = event.value
-                    yield event
+        if input_device is None or input_device.fd == -1:
+            return None
+        r, _, _ = select.select([input_device.fd], [], [], timeout)
+        if input_device.fd not in r:
+            return None
+        return self.read_batch()
 
-    def normalize_event(self, event):
-        #
-        # Oversteer expects axes as follows:
-        #
-        # - Steering wheel direction: ABS_X [0, 65535]
-        # - Throttle: ABS_Z [0, 255]
-        # - Brakes: ABS_RZ [0, 255]
-        # - Clutch: ABS_Y [0, 255]
-        # - Hat X: ABS_HAT0X [-1, 1]
-        # - Hat Y: ABS_HAT0Y [-1, 1]
-        #
-
-        if event.type == ecodes.EV_KEY:
-            if self.usb_id in [wid.LG_WFF]:
-                if event.code in [ecodes.BTN_GEAR_DOWN, ecodes.BTN_GEAR_UP]:
-                    event.code = event.code - ecodes.BTN_GEAR_DOWN + ecodes.BTN_TRIGGER
-
-        if event.type != ecodes.EV_ABS:
-            return event
-
-        if self.usb_id in [wid.LG_WFF]:
-            if event.code == ecodes.ABS_WHEEL:
-                event.code = ecodes.ABS_X
-                event.value = (event.value + 2048) * 16
-            elif event.code == ecodes.ABS_GAS:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_BRAKE:
-                event.code = ecodes.ABS_RZ
-        if event.code == ecodes.ABS_X:
-            if self.usb_id in [wid.LG_WFG, wid.LG_WFFG]:
-                event.value = event.value * 64
-            elif self.usb_id in [wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP, wid.LG_DFGT, wid.LG_G25, wid.LG_G27]:
-                event.value = event.value * 4
-            elif self.vendor_id == wid.VENDOR_CAMMUS:
-                event.value = event.value + 32768
-            elif self.usb_id in [wid.TM_T80H]:
-                event.value = event.value * 257
-        elif self.usb_id in [wid.LG_WFG, wid.LG_WFFG, wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP,
-                wid.LG_DFGT, wid.LG_G920]:
-            if event.code == ecodes.ABS_Y:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_Z:
-                event.code = ecodes.ABS_RZ
-            elif event.code == ecodes.ABS_RZ:
-                event.code = ecodes.ABS_Y
-        elif self.usb_id in [wid.TM_T248, wid.TM_T150, wid.TM_TMX]:
-            if event.code == ecodes.ABS_RZ:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_Y:
-                event.code = ecodes.ABS_RZ
-            elif event.code == ecodes.ABS_THROTTLE:
-                event.code = ecodes.ABS_Y
-        elif self.usb_id in [wid.TM_T80H]:
-            if event.code == ecodes.ABS_Y:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_Z:
-                event.code = ecodes.ABS_RZ
-        elif self.vendor_id == wid.VENDOR_FANATEC and event.code in [ecodes.ABS_Y, ecodes.ABS_Z, ecodes.ABS_RZ]:
-            event.value = int(event.value + 32768 / 257)
-        elif self.usb_id in [wid.LG_GPRO_PS, wid.LG_GPRO_XBOX]:
-            if event.code in [ecodes.ABS_RX, ecodes.ABS_RY, ecodes.ABS_RZ]:
-                event.value = int(255 - event.value / 257)
-                if event.code == ecodes.ABS_RX:
-                    event.code = ecodes.ABS_Z
-                elif event.code == ecodes.ABS_RY:
-                    event.code = ecodes.ABS_RZ
-                elif event.code == ecodes.ABS_RZ:
-                    event.code = ecodes.ABS_Y
-        elif self.usb_id == wid.LG_G923X:
-            if event.code == ecodes.ABS_Y:
-                event.code = ecodes.ABS_Z
-            elif event.code == ecodes.ABS_RZ:
-                event.code = ecodes.ABS_Y
-            elif event.code == ecodes.ABS_Z:
-                event.code = ecodes.ABS_RZ
+    def read_batch(self):
+        input_device = self.input_device
+        if input_device is None or input_device.fd == -1:
+            return None
+        if self.event_buffer is None:
+            self.event_buffer = EventBuffer()
+        events = self.event_buffer.read(input_device.fd)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.begin_batch(events)
+        events = self.normalize_batch(events)
+        # Recordings keep the normalized values before pedals are combined
+        if recorder is not None:
+            recorder.end_batch(events)
+        pedal_combiner = self.pedal_combiner
+        if pedal_combiner is not None:
+            pedal_combiner.combine_batch(events)
+        # Processed events are emitted first, everything else doesn't add latency for games
+        axis_processor = self.axis_processor
+        if axis_processor is not None:
+            axis_processor.process_batch(events)
+        self.axis_state.update_batch(events)
+        if self.telemetry is not None:
+            self.telemetry.publish(self.axis_state.values, events)
+        if self.input_stats is not None:
+            self.input_stats.update_batch(events)
+        return events
+
+    def build_event_map(self):
+        self.event_map = normalization.build_event_map(self.usb_id, self.vendor_id)
+        self.event_table = normalization.EventTable(self.event_map)
 
+    def normalize_event(self, event):
+        transform = self.event_map.get((event.type, event.code))
+        if transform is not None:
+            code, scale, offset = transform
+            event.code = code
+            event.value = int(event.value * scale + offset)
         return event
+
+    def normalize_batch(self, events):
+        if not self.event_map or len(events) == 0:
+            return events
+        events['code'], events['value'] = self.event_table.normalize(events['type'], events['code'], events['value'])
+        return events
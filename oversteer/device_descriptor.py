@@ -0,0 +1,41 @@
+from evdev import ecodes
+import logging
+
+class DeviceDescriptor:
+
+    # Sysfs attributes Oversteer can use
+    attributes = [
+        'alternate_modes',
+        'range',
+        'combine_pedals',
+        'gain',
+        'autocenter',
+        'spring_level',
+        'damper_level',
+        'friction_level',
+        'ffb_leds',
+        'peak_ffb_level',
+    ]
+
+    def __init__(self, device):
+        self.existing = frozenset(name for name in self.attributes if device.has_device_file(name))
+        self.writable = frozenset(name for name in self.existing if device.checked_device_file(name))
+        self.permissions = device.read_permissions()
+        self.ff_effects = frozenset()
+        self.ff_effects_count = 0
+        input_device = device.get_input_device()
+        if input_device is not None:
+            self.ff_effects = frozenset(input_device.capabilities().get(ecodes.EV_FF, []))
+            self.ff_effects_count = input_device.ff_effects_count
+        self.max_range = device.get_max_range()
+        self.modes = device.read_modes()
+        logging.debug("Device descriptor for %s: %s", device.name, vars(self))
+
+    def has_attribute(self, name):
+        return name in self.existing
+
+    def is_writable(self, name):
+        return name in self.writable
+
+    def has_ff_effect(self, effect):
+        return effect in self.ff_effects
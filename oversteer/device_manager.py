@@ -1,12 +1,18 @@
 import logging
 import os
 import pyudev
+import re
+from threading import Lock, Timer
 import time
 from .device import Device
+from .replay_device import ReplayDevice
 from . import wheel_ids as wid
 
 class DeviceManager:
 
+    # Uevents of a physical device arriving within this time are handled together
+    uevent_window = 0.1
+
     def __init__(self):
         self.supported_wheels = {
             wid.CM_C5: 1080,
@@ -53,7 +59,10 @@ class DeviceManager:
             wid.FF_FLASHFIRE_900R: 900, 
         }
         self.devices = {}
-        self.changed = True
+        self.subscribers = []
+        self.lock = Lock()
+        self.pending_events = {}
+        self.active_keys = set()
 
     def start(self):
         context = pyudev.Context()
@@ -66,23 +75,110 @@ class DeviceManager:
     def stop(self):
         self.observer.stop()
 
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def notify(self, action, device):
+        for callback in self.subscribers:
+            callback(action, device)
+
     def register_event(self, action, udevice):
         id = udevice.device_path
         if id is None:
             return
         logging.debug("Udev event %s: %s", action, id)
+        # Devices are tracked by their event node, the input and js nodes are ignored
+        if 'event' not in (udevice.get('DEVNAME') or ''):
+            return
+        key = self.physical_path(udevice)
+        with self.lock:
+            if key in self.pending_events:
+                self.pending_events[key].append((action, udevice))
+                return
+            self.pending_events[key] = [(action, udevice)]
+            # A device already being handled picks its new events up when it's done
+            if key in self.active_keys:
+                return
+            self.active_keys.add(key)
+        # Each physical device gets its own thread, so several can be brought up in parallel
+        timer = Timer(self.uevent_window, self.process_events, [key])
+        timer.daemon = True
+        timer.start()
+
+    def physical_path(self, udevice):
+        # The path above the hid device, BUS:VENDOR:PRODUCT.INSTANCE. It's taken from the
+        # device path as the hid device is already gone when the remove events arrive.
+        match = re.match(r'(.*)/[0-9A-Fa-f]{4}:[0-9A-Fa-f]{4}:[0-9A-Fa-f]{4}\.[0-9A-Fa-f]+/', udevice.device_path)
+        if match is None:
+            return udevice.device_path
+        return match.group(1)
+
+    def coalesce_events(self, events):
+        # Keeps the latest add or change of each node, and a remove only when the
+        # node isn't added back afterwards, or a remove followed by an add
+        coalesced = {}
+        for action, udevice in events:
+            node_events = coalesced.setdefault(udevice.device_path, [])
+            if action == 'remove':
+                while node_events and node_events[-1][0] != 'remove':
+                    node_events.pop()
+                if not node_events:
+                    node_events.append((action, udevice))
+            elif node_events and node_events[-1][0] != 'remove':
+                if action == 'add' or node_events[-1][0] == 'change':
+                    node_events[-1] = (action, udevice)
+                else:
+                    node_events[-1] = (node_events[-1][0], udevice)
+            else:
+                node_events.append((action, udevice))
+        return [event for node_events in coalesced.values() for event in node_events]
+
+    def process_events(self, key):
+        # Groups of the same physical device are handled one after the other
+        while True:
+            with self.lock:
+                events = self.pending_events.pop(key)
+            coalesced = self.coalesce_events(events)
+            logging.debug("Udev events for %s: %d received, %d handled", key, len(events), len(coalesced))
+            for action, udevice in coalesced:
+                self.handle_event(action, udevice)
+            with self.lock:
+                if key not in self.pending_events:
+                    self.active_keys.remove(key)
+                    return
+            # Events that arrived meanwhile get a window to gather too
+            time.sleep(self.uevent_window)
+
+    def handle_event(self, action, udevice):
+        id = udevice.device_path
         if action == 'add':
             self.update_device_list(udevice)
             device = self.get_device(id)
             if device:
-                time.sleep(5)
-                device.enable()
-                self.changed = True
+                self.activate_device(device)
+        if action == 'change':
+            device = self.get_device(id)
+            if device and device.is_ready():
+                device.refresh_descriptor()
         if action == 'remove':
             device = self.get_device(id)
             if device:
                 device.disable()
-                self.changed = True
+                self.notify('remove', device)
+
+    def activate_device(self, device):
+        if not device.wait_usable():
+            logging.warning("%s didn't become usable in %d s", device.name, device.ready_timeout)
+            return
+        device.enable()
+        device.refresh_descriptor()
+        for other in self.get_devices():
+            if other is not device and not other.is_ready() and other.port_path == device.port_path:
+                other.set_successor(device)
+        self.notify('ready', device)
 
     def init_device_list(self):
         context = pyudev.Context()
@@ -94,8 +190,6 @@ class DeviceManager:
         for key in self.devices:
             logging.debug("%s: %s", key, vars(self.devices[key]))
 
-        self.changed = True
-
     def update_device_list(self, udevice):
         id = udevice.device_path
         device_node = udevice.device_node
@@ -103,32 +197,51 @@ class DeviceManager:
         if not id or not device_node or not 'event' in udevice.get('DEVNAME'):
             return
 
+        # Skip our own virtual devices, they share the ids of the wheel they're created for
+        if id.startswith('/devices/virtual/'):
+            return
+
         usb_id = str(udevice.get('ID_VENDOR_ID')) + ':' + str(udevice.get('ID_MODEL_ID'))
         if not usb_id in self.supported_wheels:
             return
 
         logging.debug("update_device_list: %s %s", id, device_node)
 
-        if id not in self.devices:
-            self.devices[id] = Device(self, {})
-
-        device = self.devices[id]
+        with self.lock:
+            is_new = id not in self.devices
+            if is_new:
+                self.devices[id] = Device(self, {})
+            device = self.devices[id]
 
         logging.debug("%s: ID_VENDOR_ID: %s ID_MODEL_ID: %s", device_node,
                       udevice.get('ID_VENDOR_ID'), udevice.get('ID_MODEL_ID'))
 
+        dev_path = os.path.realpath(os.path.join(udevice.sys_path, 'device', 'device'))
         device.set({
             'id': id,
             'vendor_id': udevice.get('ID_VENDOR_ID'),
             'product_id': udevice.get('ID_MODEL_ID'),
             'usb_id': usb_id,
             'dev_name': device_node,
-            'dev_path': os.path.realpath(os.path.join(udevice.sys_path, 'device', 'device')),
+            'dev_path': dev_path,
+            # The interface the device is on, it outlives the device when the mode changes
+            'port_path': os.path.dirname(dev_path),
             'name': bytes(udevice.get('ID_VENDOR_ENC') + ' ' + udevice.get('ID_MODEL_ENC'),
                           'utf-8').decode('unicode_escape'),
             'max_range': self.supported_wheels[usb_id],
             })
 
+        if is_new:
+            self.notify('add', device)
+
+    def add_replay_device(self, path, speed = 1):
+        device = ReplayDevice(self, path, speed)
+        self.devices[device.get_id()] = device
+        logging.debug("add_replay_device: %s", device.get_id())
+        self.notify('add', device)
+        self.notify('ready', device)
+        return device
+
     def first_device(self):
         if self.devices:
             return self.get_device(next(iter(self.devices)))
@@ -143,8 +256,3 @@ class DeviceManager:
         if did in self.devices:
             return self.devices[did]
         return next((item for item in self.devices.values() if item.dev_name == did), None)
-
-    def is_changed(self):
-        changed = self.changed
-        self.changed = False
-        return changed
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import time
+from typing import NamedTuple, Optional, Tuple
+
+class DeviceSnapshot(NamedTuple):
+    mode: Optional[str]
+    modes: Optional[Tuple[Tuple[str, str, bool], ...]]
+    range: Optional[int]
+    ff_gain: Optional[int]
+    autocenter: Optional[int]
+    combine_pedals: Optional[int]
+    spring_level: Optional[int]
+    damper_level: Optional[int]
+    friction_level: Optional[int]
+    ffb_leds: Optional[int]
+    peak_ffb_level: Optional[int]
+
+# Attribute values of the fake sysfs tree used by benchmark()
+fake_attributes = {
+    'alternate_modes': "native: Native\nDF-EX: Driving Force / Formula EX\nG29: G29 Racing Wheel *\n",
+    'range': "900\n",
+    'combine_pedals': "0\n",
+    'gain': "65535\n",
+    'autocenter': "0\n",
+    'spring_level': "30\n",
+    'damper_level': "30\n",
+    'friction_level': "30\n",
+    'ffb_leds': "0\n",
+    'peak_ffb_level': "0\n",
+}
+
+def benchmark(count = 1000):
+    # Times snapshots of a device backed by a fake sysfs tree, with its attributes
+    # opened on every snapshot and kept open across snapshots
+    from .device import Device
+    with tempfile.TemporaryDirectory() as path:
+        for name, value in fake_attributes.items():
+            with open(os.path.join(path, name), 'w') as file:
+                file.write(value)
+        device = Device(None, {'dev_path': path, 'name': 'Fake wheel', 'max_range': 900})
+        device.get_descriptor()
+        results = {}
+        start_time = time.perf_counter()
+        for i in range(count):
+            device.close_attributes()
+            device.snapshot()
+        results['cold'] = (time.perf_counter() - start_time) / count
+        start_time = time.perf_counter()
+        for i in range(count):
+            device.snapshot()
+        results['warm'] = (time.perf_counter() - start_time) / count
+        device.close_attributes()
+    return results
+
+if __name__ == '__main__':
+    for name, seconds in benchmark().items():
+        print("{}: {:.1f} us per snapshot".format(name, seconds * 1000000))
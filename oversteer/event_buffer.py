@@ -0,0 +1,49 @@
+import numpy as np
+import os
+import time
+
+class EventBuffer:
+
+    # Native layout of struct input_event: struct timeval followed by type, code and value
+    dtype = np.dtype([
+        ('sec', 'l'),
+        ('usec', 'l'),
+        ('type', 'u2'),
+        ('code', 'u2'),
+        ('value', 'i4'),
+    ])
+
+    # Devices are switched to this clock so event timestamps can be compared with now()
+    clock = time.CLOCK_MONOTONIC
+
+    def __init__(self, capacity = 256):
+        self.buffer = bytearray(capacity * self.dtype.itemsize)
+        self.events = np.frombuffer(self.buffer, dtype=self.dtype)
+
+    def get_capacity(self):
+        return len(self.events)
+
+    def read(self, fd):
+        # The returned array is a view on the internal buffer, it's only valid
+        # until the next read. Callers that keep events must copy them.
+        try:
+            size = os.readv(fd, [self.buffer])
+        except BlockingIOError:
+            size = 0
+        return self.events[:size // self.dtype.itemsize]
+
+    @staticmethod
+    def timestamps(events):
+        return events['sec'] + events['usec'] / 1000000
+
+    @staticmethod
+    def timestamps_us(events):
+        return events['sec'].astype(np.int64) * 1000000 + events['usec']
+
+    @classmethod
+    def now(cls):
+        return time.clock_gettime(cls.clock)
+
+    @classmethod
+    def now_us(cls):
+        return time.clock_gettime_ns(cls.clock) // 1000
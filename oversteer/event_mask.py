@@ -0,0 +1,55 @@
+import ctypes
+from evdev import ecodes
+import fcntl
+import struct
+
+# _IOW('E', 0x93, struct input_mask)
+EVIOCSMASK = 0x40104593
+
+# Event types that can be masked and the size of their code bitmaps
+code_counts = {
+    ecodes.EV_KEY: ecodes.KEY_CNT,
+    ecodes.EV_ABS: ecodes.ABS_CNT,
+    ecodes.EV_MSC: ecodes.MSC_CNT,
+}
+
+#
+# Consumer interests map event types to the normalized codes they read, None
+# stands for all the codes of a type. An interest of None takes every event.
+#
+
+# Events shown in the main window
+default_interest = {
+    ecodes.EV_ABS: [ecodes.ABS_X, ecodes.ABS_Y, ecodes.ABS_Z, ecodes.ABS_RZ, ecodes.ABS_HAT0X, ecodes.ABS_HAT0Y],
+    ecodes.EV_KEY: None,
+}
+
+# Events forwarded to other programs
+forward_interest = {
+    ecodes.EV_ABS: None,
+    ecodes.EV_KEY: None,
+}
+
+def merge_interests(interests):
+    mask = {event_type: set() for event_type in code_counts}
+    for interest in interests:
+        if interest is None:
+            return {event_type: None for event_type in code_counts}
+        for event_type, codes in interest.items():
+            if mask[event_type] is None:
+                continue
+            if codes is None:
+                mask[event_type] = None
+            else:
+                mask[event_type].update(codes)
+    return mask
+
+def set_event_mask(fd, event_type, codes):
+    count = code_counts[event_type]
+    bitmap = (ctypes.c_ubyte * ((count + 7) // 8))()
+    if codes is None:
+        ctypes.memset(bitmap, 0xff, len(bitmap))
+    else:
+        for code in codes:
+            bitmap[code >> 3] |= 1 << (code & 7)
+    fcntl.ioctl(fd, EVIOCSMASK, struct.pack('IIQ', event_type, len(bitmap), ctypes.addressof(bitmap)))
@@ -0,0 +1,86 @@
+import gi
+import logging
+gi.require_version('GLib', '2.0')
+from gi.repository import GLib
+from .input_reactor import read_batches
+
+class GLibInputSource:
+
+    def __init__(self):
+        self.sources = {}
+        self.handlers = {}
+        self.default_handler = None
+        self.wakeups = 0
+
+    def attach(self, device_manager):
+        device_manager.subscribe(self.on_device_event)
+        for device in device_manager.get_devices():
+            if device.is_ready():
+                self.add_device(device)
+
+    def on_device_event(self, action, device):
+        # Udev notifications arrive on the observer thread
+        GLib.idle_add(self._on_device_event, action, device)
+
+    def _on_device_event(self, action, device):
+        if action == 'ready':
+            self.add_device(device)
+        elif action == 'remove':
+            self.remove_device(device)
+        return False
+
+    def set_handler(self, handler, device = None):
+        if device is None:
+            self.default_handler = handler
+        else:
+            self.handlers[device.get_id()] = handler
+
+    def get_handler(self, device):
+        return self.handlers.get(device.get_id(), self.default_handler)
+
+    def get_devices(self):
+        return [device for device, _ in self.sources.values()]
+
+    def get_wakeups(self):
+        return self.wakeups
+
+    def add_device(self, device):
+        input_device = device.get_input_device()
+        if input_device is None or input_device.fd == -1:
+            return False
+        self.remove_device(device)
+        source_id = GLib.io_add_watch(input_device.fd, GLib.PRIORITY_DEFAULT,
+                GLib.IO_IN | GLib.IO_ERR | GLib.IO_HUP, self.on_ready, device)
+        self.sources[device.get_id()] = (device, source_id)
+        logging.debug("GLibInputSource: added %s (fd %d)", device.get_id(), input_device.fd)
+        return True
+
+    def remove_device(self, device):
+        if device.get_id() in self.sources:
+            _, source_id = self.sources.pop(device.get_id())
+            GLib.source_remove(source_id)
+            logging.debug("GLibInputSource: removed %s", device.get_id())
+
+    def start(self):
+        pass
+
+    def stop(self):
+        for device, _ in list(self.sources.values()):
+            self.remove_device(device)
+
+    def on_ready(self, fd, condition, device):
+        self.wakeups += 1
+        if condition & GLib.IO_IN:
+            handler = self.get_handler(device)
+            try:
+                for events in read_batches(device, condition & GLib.IO_HUP):
+                    if handler is not None:
+                        handler(device, events)
+            except OSError as e:
+                logging.debug(e)
+                self.sources.pop(device.get_id(), None)
+                return False
+        if condition & (GLib.IO_ERR | GLib.IO_HUP):
+            self.sources.pop(device.get_id(), None)
+            return False
+        return True
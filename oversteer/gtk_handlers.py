@@ -1,6 +1,5 @@
 import gi
 from locale import gettext as _
-import threading
 import traceback
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk
@@ -135,7 +134,7 @@ class GtkHandlers:
         self.model.set_use_buttons(state)
 
     def on_center_wheel_state_set(self, widget, state):
-        threading.Thread(target = self.model.set_center_wheel, args = [state], daemon = True).start()
+        self.model.set_center_wheel(state)
 
     def on_profile_changed(self, combobox):
         self.controller.load_profile(combobox.get_active_id())
@@ -4,16 +4,36 @@ from locale import gettext as _
 import logging
 import math
 import os
+import threading
+import time
+from .event_buffer import EventBuffer
 from .gtk_handlers import GtkHandlers
+from .latency_stats import LatencyStats
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk, GLib
 
 class GtkUi:
 
+    # Interval in ms between input widget updates (~60 fps)
+    input_frame_interval = 16
+
+    # Minimum time in seconds a pressed button stays lit
+    button_hold_time = 0.1
+
     def __init__(self, controller, argv):
         self.controller = controller
 
         self.ffbmeter_timer = False
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.input_lock = threading.Lock()
+        self.input_flush_scheduled = False
+        self.pending_inputs = {}
+        self.pending_buttons = {}
+        self.pending_presses = {}
+        self.displayed_inputs = {}
+        self.button_shown_at = {}
+        self.input_latency = {}
         self.current_test_canvas = None
         self.current_test_toolbar = None
 
@@ -32,6 +52,15 @@ class GtkUi:
 
         self._set_builder_objects()
 
+        self.input_setters = {
+            'steering': self.set_steering_input,
+            'clutch': self.set_clutch_input,
+            'accelerator': self.set_accelerator_input,
+            'brakes': self.set_brakes_input,
+            'hatx': self.set_hatx_input,
+            'haty': self.set_haty_input,
+        }
+
         self._set_markers()
 
         cell_renderer = Gtk.CellRendererText()
@@ -71,7 +100,26 @@ class GtkUi:
         Gtk.main_quit()
 
     def safe_call(self, callback, *args):
-        GLib.idle_add(callback, *args)
+        if threading.current_thread() is threading.main_thread():
+            callback(*args)
+            return
+        self.queue_depth += 1
+        if self.queue_depth > self.max_queue_depth:
+            self.max_queue_depth = self.queue_depth
+        GLib.idle_add(self._run_queued_call, callback, *args)
+
+    def _run_queued_call(self, callback, *args):
+        self.queue_depth -= 1
+        callback(*args)
+        return False
+
+    def get_queue_stats(self):
+        stats = (self.queue_depth, self.max_queue_depth)
+        self.max_queue_depth = self.queue_depth
+        return stats
+
+    def set_interval(self, interval, callback):
+        GLib.timeout_add(interval, callback)
 
     def confirmation_dialog(self, message):
         dialog = Gtk.MessageDialog(self.window, 0,
@@ -172,13 +220,18 @@ class GtkUi:
         model = self.device_combobox.get_model()
         if model is None:
             model = Gtk.ListStore(str, str)
-        else:
-            self.device_combobox.set_model(None)
-            model.clear()
-        self.device_combobox.set_model(model)
+            self.device_combobox.set_model(model)
+        names = dict(devices)
+        rows = {row[0]: row for row in model}
+        for device_id, row in rows.items():
+            if device_id not in names:
+                model.remove(row.iter)
+            elif row[1] != names[device_id]:
+                row[1] = names[device_id]
+        for device_id, name in devices:
+            if device_id not in rows:
+                model.append([device_id, name])
         if devices:
-            for pair in devices:
-                model.append(pair)
             if self.device_combobox.get_active() == -1:
                 self.device_combobox.set_active(0)
             self.enable_controls()
@@ -368,45 +421,112 @@ class GtkUi:
     def set_new_profile_name(self, name):
         self.new_profile_name.set_text(name)
 
+    def queue_input(self, name, value, timestamp = None):
+        with self.input_lock:
+            self.pending_inputs[name] = (value, timestamp)
+            self._schedule_input_flush()
+
+    def queue_btn_input(self, index, value, timestamp = None):
+        with self.input_lock:
+            if value:
+                self.pending_presses[index] = timestamp
+            self.pending_buttons[index] = (value, timestamp)
+            self._schedule_input_flush()
+
+    def _schedule_input_flush(self):
+        if not self.input_flush_scheduled:
+            self.input_flush_scheduled = True
+            GLib.timeout_add(self.input_frame_interval, self._flush_inputs)
+
+    def _flush_inputs(self):
+        now = time.monotonic()
+        with self.input_lock:
+            pending_inputs = self.pending_inputs
+            pending_buttons = self.pending_buttons
+            pending_presses = self.pending_presses
+            self.pending_inputs = {}
+            self.pending_buttons = {}
+            self.pending_presses = {}
+
+        # Presses are shown even if the button was released within the same frame
+        for index, timestamp in pending_presses.items():
+            self.set_btn_input(index, 1)
+            self.button_shown_at[index] = now
+            self._record_input_latency('buttons', timestamp)
+
+        deferred_buttons = {}
+        for index, (value, timestamp) in pending_buttons.items():
+            if not value and now - self.button_shown_at.get(index, 0) < self.button_hold_time:
+                # The hold time isn't input latency, don't measure deferred releases
+                deferred_buttons[index] = (value, None)
+            elif not value:
+                self.set_btn_input(index, value)
+                self._record_input_latency('buttons', timestamp)
+
+        for name, (value, timestamp) in pending_inputs.items():
+            if self.displayed_inputs.get(name) != value:
+                self.displayed_inputs[name] = value
+                self.input_setters[name](value)
+                self._record_input_latency(name, timestamp)
+
+        with self.input_lock:
+            for index, pending in deferred_buttons.items():
+                self.pending_buttons.setdefault(index, pending)
+            if self.pending_inputs or self.pending_buttons or self.pending_presses:
+                return True
+            self.input_flush_scheduled = False
+            return False
+
+    def _record_input_latency(self, name, timestamp):
+        if timestamp is None:
+            return
+        # Event timestamps come from the kernel's monotonic clock
+        latency = EventBuffer.now() - timestamp
+        if name not in self.input_latency:
+            self.input_latency[name] = LatencyStats()
+        self.input_latency[name].record(latency)
+
+    def get_input_latency(self):
+        return self.input_latency
+
+    def reset_input_latency(self):
+        self.input_latency = {}
+
     def set_steering_input(self, value):
         if value < 32768:
-            self.steering_left_input.set_value(self._round_input((32768 - value) / 32768, 3))
-            self.steering_right_input.set_value(0)
+            self._set_level(self.steering_left_input, self._round_input((32768 - value) / 32768, 3))
+            self._set_level(self.steering_right_input, 0)
         else:
-            self.steering_left_input.set_value(0)
-            self.steering_right_input.set_value(self._round_input((value - 32768) / 32768, 3))
+            self._set_level(self.steering_left_input, 0)
+            self._set_level(self.steering_right_input, self._round_input((value - 32768) / 32768, 3))
 
     def set_clutch_input(self, value):
-        self.clutch_input.set_value(self._round_input((255 - value) / 255, 2))
+        self._set_level(self.clutch_input, self._round_input((255 - value) / 255, 2))
 
     def set_accelerator_input(self, value):
-        self.accelerator_input.set_value(self._round_input((255 - value) / 255, 2))
+        self._set_level(self.accelerator_input, self._round_input((255 - value) / 255, 2))
 
     def set_brakes_input(self, value):
-        self.brakes_input.set_value(self._round_input((255 - value) / 255, 2))
+        self._set_level(self.brakes_input, self._round_input((255 - value) / 255, 2))
 
     def set_hatx_input(self, value):
         if value < 0:
-            self.hat_left_input.set_value(-value)
-            self.hat_right_input.set_value(0)
+            self._set_level(self.hat_left_input, -value)
+            self._set_level(self.hat_right_input, 0)
         else:
-            self.hat_left_input.set_value(0)
-            self.hat_right_input.set_value(value)
+            self._set_level(self.hat_left_input, 0)
+            self._set_level(self.hat_right_input, value)
 
     def set_haty_input(self, value):
         if value < 0:
-            self.hat_up_input.set_value(-value)
-            self.hat_down_input.set_value(0)
+            self._set_level(self.hat_up_input, -value)
+            self._set_level(self.hat_down_input, 0)
         else:
-            self.hat_up_input.set_value(0)
-            self.hat_down_input.set_value(value)
+            self._set_level(self.hat_up_input, 0)
+            self._set_level(self.hat_down_input, value)
 
-    def set_btn_input(self, index, value, wait = None):
-        if wait is not None:
-            GLib.timeout_add(wait, lambda index=index, value=value: self.set_btn_input(index, value))
-        else:
-            self.btn_input[index].set_value(value)
-        return False
+    def set_btn_input(self, index, value):
+        self._set_level(self.btn_input[index], value)
 
     def set_ffbmeter_overlay_visibility(self, state):
         self.ffbmeter_overlay.set_sensitive(state)
@@ -543,6 +663,10 @@ class GtkUi:
         self.overlay_led_4.set_value((led_states >> 4) & 1)
         return True
 
+    def _set_level(self, widget, value):
+        if widget.get_value() != value:
+            widget.set_value(value)
+
     def _round_input(self, value, decimals = 0):
         multiplier = 10 ** decimals
         return math.floor(value * multiplier) / multiplier
@@ -14,10 +14,14 @@ import sys
 from threading import Thread
 import time
 from xdg.BaseDirectory import save_config_path
+from .glib_input import GLibInputSource
 from .gtk_ui import GtkUi
+from .input_reactor import InputReactor
 from .model import Model
 from .test import Test
 from .combined_chart import CombinedChart
+from .event_buffer import EventBuffer
+from . import event_mask
 from .linear_chart import LinearChart
 from .performance_chart import PerformanceChart
 
@@ -58,6 +62,7 @@ class Gui:
         self.device = None
         self.grab_input = False
         self.test = None
+        self.recorded_device = None
         self.linear_chart = None
         self.performance_chart = None
         self.combined_chart = None
@@ -108,10 +113,28 @@ class Gui:
             else:
                 self.start_app()
 
-        Thread(target=self.input_thread, daemon = True).start()
+        self.device_manager.subscribe(self.on_device_event)
+        if self.app.args.io_watch:
+            self.input_reactor = GLibInputSource()
+        else:
+            self.input_reactor = InputReactor()
+        self.input_reactor.set_handler(self.on_input_events)
+        self.input_reactor.attach(self.device_manager)
+        self.input_reactor.start()
+
+        if self.app.args.debug:
+            self.last_input_stats = (time.monotonic(), 0)
+            self.ui.set_interval(5000, self.log_input_stats)
 
         self.ui.main()
 
+        self.input_reactor.stop()
+        for device in self.device_manager.get_devices():
+            device.disable_axis_processing()
+        if self.device is not None:
+            self.device.stop_recording()
+            self.device.stop_telemetry()
+
     def start_app(self):
         self.ui.disable_start_app()
         Thread(target=self.run_command).start() 
@@ -149,12 +172,11 @@ class Gui:
 
     def populate_devices(self):
         logging.debug("populate_devices")
-        if self.device_manager.is_changed():
-            device_list = []
-            for device in self.device_manager.get_devices():
-                if device.is_ready():
-                    device_list.append((device.get_id(), device.name))
-            self.ui.set_devices(device_list)
+        device_list = []
+        for device in self.device_manager.get_devices():
+            if device.is_ready():
+                device_list.append((device.get_id(), device.name))
+        self.ui.set_devices(device_list)
 
     def populate_profiles(self):
         profiles = []
@@ -168,7 +190,13 @@ class Gui:
         self.populate_profiles()
 
     def change_device(self, device_id):
-        self.device = self.device_manager.get_device(device_id)
+        device = self.device_manager.get_device(device_id)
+        if self.device is not None and self.device is not device:
+            self.device.stop_recording()
+            self.device.stop_telemetry()
+            self.device.clear_event_interest('gui')
+
+        self.device = device
 
         if self.device is None or not self.device.is_ready():
             return
@@ -179,23 +207,39 @@ class Gui:
             else:
                 self.ui.info_dialog(_("You don't have the required permissions to change your wheel settings."))
 
+        snapshot = self.device.snapshot()
+
         if not self.models:
-            self.model.set_device(self.device)
+            self.model.set_device(self.device, snapshot)
             self.models[self.device.get_id()] = self.model
         if self.device.get_id() in self.models:
             self.model = self.models[self.device.get_id()]
         else:
-            self.model = Model(self.device, self.ui)
+            self.model = Model(self.device, self.ui, snapshot)
             self.models[self.device.get_id()] = self.model
 
-        self.ui.set_max_range(self.device.get_max_range())
-        self.ui.set_modes(self.model.get_mode_list())
+        if self.app.args.debug:
+            self.device.enable_input_stats()
+
+        self.device.enable_axis_processing()
+        self.device.set_event_interest('gui', event_mask.default_interest)
+
+        # Only the first device selected is recorded, recording another one, or the same one
+        # again, would truncate the file
+        if self.app.args.record is not None and self.recorded_device is None:
+            self.recorded_device = self.device
+            self.device.start_recording(self.app.args.record)
+
+        if self.app.args.telemetry is not None and self.device.get_telemetry() is None:
+            self.device.start_telemetry(self.app.args.telemetry)
+
+        self.ui.set_max_range(self.device.get_descriptor().max_range)
+        self.ui.set_modes(snapshot.modes)
 
         if self.model.get_profile():
             self.ui.set_profile(self.model.get_profile())
         else:
-            self.model.flush_device()
-            self.model.flush_ui()
+            self.flush_device()
 
     def load_profile(self, profile_name):
         if profile_name is None or profile_name == '':
@@ -207,8 +251,16 @@ class Gui:
             return
 
         self.model.load(profile_file)
-        self.model.flush_device()
-        self.model.flush_ui()
+        self.flush_device()
+
+    def flush_device(self):
+        # The writes, and a mode change, run on the device command queue, the window is
+        # updated once they're done
+        if self.device is None:
+            return
+        model = self.model
+        future = self.device.submit('flush', model.flush_device)
+        future.add_done_callback(lambda future: self.ui.safe_call(model.flush_ui))
 
     def save_profile(self, profile_name, check_exists = False):
         if self.device is None:
@@ -367,13 +419,12 @@ class Gui:
                 if value == 1:
                     self.pressed_button_count += 1
                     if self.pressed_button_count == len(self.button_config[0]):
-                        device = self.device.get_input_device()
                         if self.grab_input:
-                            device.ungrab()
+                            self.device.grab_input(False)
                             self.grab_input = False
                             self.ui.safe_call(self.ui.update_overlay, False)
                         else:
-                            device.grab()
+                            self.device.grab_input(True)
                             self.grab_input = True
                             self.ui.safe_call(self.ui.update_overlay, True)
                 else:
@@ -391,6 +442,9 @@ class Gui:
 
     def read_ffbmeter(self):
         level = self.device.get_peak_ffb_level()
+        telemetry = self.device.get_telemetry()
+        if telemetry is not None:
+            telemetry.set_ffb_level(level)
         if level is None:
             return level
         level = int(level)
@@ -399,66 +453,83 @@ class Gui:
         return level
 
     def process_events(self, events):
-        for event in events:
-            if event.type == ecodes.EV_ABS:
-                if event.code == ecodes.ABS_X:
-                    self.last_wheel_axis_value = event.value
-                    if self.test and self.test.is_collecting_data():
-                        self.test.append_data(event.timestamp(), event.value)
-                    else:
-                        self.ui.safe_call(self.ui.set_steering_input, event.value)
-                elif event.code == ecodes.ABS_Z:
-                    self.ui.safe_call(self.ui.set_accelerator_input, event.value)
-                elif event.code == ecodes.ABS_RZ:
-                    self.ui.safe_call(self.ui.set_brakes_input, event.value)
-                elif event.code == ecodes.ABS_Y:
-                    self.ui.safe_call(self.ui.set_clutch_input, event.value)
-                elif event.code == ecodes.ABS_HAT0X:
-                    self.ui.safe_call(self.ui.set_hatx_input, event.value)
-                    if event.value == -1:
+        collecting_data = self.test is not None and self.test.is_collecting_data()
+        if collecting_data:
+            self.test.append_batch(events)
+        for event_type, code, value, timestamp in zip(events['type'].tolist(), events['code'].tolist(),
+                events['value'].tolist(), EventBuffer.timestamps(events).tolist()):
+            if event_type == ecodes.EV_ABS:
+                if code == ecodes.ABS_X:
+                    self.last_wheel_axis_value = value
+                    if not collecting_data:
+                        self.ui.queue_input('steering', value, timestamp)
+                elif code == ecodes.ABS_Z:
+                    self.ui.queue_input('accelerator', value, timestamp)
+                elif code == ecodes.ABS_RZ:
+                    self.ui.queue_input('brakes', value, timestamp)
+                elif code == ecodes.ABS_Y:
+                    self.ui.queue_input('clutch', value, timestamp)
+                elif code == ecodes.ABS_HAT0X:
+                    self.ui.queue_input('hatx', value, timestamp)
+                    if value == -1:
                         self.on_button_press(100, 1)
-                    elif event.value == 1:
+                    elif value == 1:
                         self.on_button_press(101, 1)
-                elif event.code == ecodes.ABS_HAT0Y:
-                    self.ui.safe_call(self.ui.set_haty_input, event.value)
-                    if event.value == -1:
+                elif code == ecodes.ABS_HAT0Y:
+                    self.ui.queue_input('haty', value, timestamp)
+                    if value == -1:
                         self.on_button_press(102, 1)
-                    elif event.value == 1:
+                    elif value == 1:
                         self.on_button_press(103, 1)
-            if event.type == ecodes.EV_KEY:
-                if event.value:
-                    delay = 0
+            if event_type == ecodes.EV_KEY:
+                if value:
                     if self.test and self.test.is_awaiting_action():
                         self.test.trigger_action()
-                else:
-                    delay = 100
 
                 button = None
 
-                if event.code >= 288 and event.code <= 303:
-                    button = event.code - 288
-                if event.code >= 304 and event.code <= 316:
-                    button = event.code - 304
-                if event.code >= 704 and event.code <= 715:
-                    button = event.code - 688
+                if code >= 288 and code <= 303:
+                    button = code - 288
+                if code >= 304 and code <= 316:
+                    button = code - 304
+                if code >= 704 and code <= 715:
+                    button = code - 688
 
                 if button is not None:
-                    self.ui.safe_call(self.ui.set_btn_input, button, event.value, delay)
-                    self.on_button_press(button, event.value)
-
-    def input_thread(self):
-        while 1:
-            if self.device is not None and self.device.is_ready():
-                try:
-                    events = self.device.read_events(0.5)
-                    if events is not None:
-                        self.process_events(events)
-                except OSError as e:
-                    logging.debug(e)
-                    time.sleep(1)
-            else:
-                time.sleep(1)
-            self.ui.safe_call(self.populate_devices)
+                    self.ui.queue_btn_input(button, value, timestamp)
+                    self.on_button_press(button, value)
+
+    def on_input_events(self, device, events):
+        if device is self.device:
+            self.process_events(events)
+
+    def on_device_event(self, action, device):
+        self.ui.safe_call(self.populate_devices)
+
+    def log_input_stats(self):
+        now = time.monotonic()
+        wakeups = self.input_reactor.get_wakeups()
+        last_time, last_wakeups = self.last_input_stats
+        self.last_input_stats = (now, wakeups)
+        queue_depth, max_queue_depth = self.ui.get_queue_stats()
+        logging.debug("Input stats (%s): %.1f wakeups/s, UI queue depth: %d (max %d)",
+                type(self.input_reactor).__name__, (wakeups - last_wakeups) / (now - last_time),
+                queue_depth, max_queue_depth)
+        for name, latency_stats in self.ui.get_input_latency().items():
+            logging.debug("Input to widget latency (%s): %s", name, latency_stats.format_report())
+        if self.device is not None and self.device.get_input_stats() is not None:
+            logging.debug("Device input stats (%s):\n%s", self.device.name,
+                    self.device.get_input_stats().format_report())
+        if self.device is not None:
+            for (name, operation), (calls, saved) in sorted(self.device.get_attribute_stats().items()):
+                logging.debug("Attribute %s %s: %d calls, %d syscalls saved", name, operation, calls, saved)
+        if self.device is not None and self.device.command_queue is not None:
+            logging.debug("Command queue (%s): %s", self.device.name,
+                    self.device.command_queue.format_report())
+        if self.device is not None and self.device.get_axis_processor() is not None:
+            logging.debug("Axis processing (%s): %s", self.device.name,
+                    self.device.get_axis_processor().format_report())
+        return True
 
     def run_command(self):
         proc = subprocess.Popen(self.app.args.command, shell=True)
@@ -0,0 +1,132 @@
+import logging
+import os
+import select
+from threading import Lock, Thread
+
+def read_batches(device, hangup):
+    # Yields the batches ready on a device, reading again while reads fill the buffer.
+    # A hung up fd is read until it's empty, so a closed pipe doesn't lose its last events.
+    while True:
+        events = device.read_batch()
+        if events is None or len(events) == 0:
+            return
+        yield events
+        if not hangup and len(events) < device.event_buffer.get_capacity():
+            return
+
+class InputReactor:
+
+    def __init__(self):
+        self.epoll = select.epoll()
+        self.lock = Lock()
+        self.devices = {}
+        self.handlers = {}
+        self.default_handler = None
+        self.thread = None
+        self.running = False
+        self.wakeups = 0
+        self.wakeup_fd, self.wakeup_write_fd = os.pipe()
+        os.set_blocking(self.wakeup_fd, False)
+        self.epoll.register(self.wakeup_fd, select.EPOLLIN)
+
+    def attach(self, device_manager):
+        device_manager.subscribe(self.on_device_event)
+        for device in device_manager.get_devices():
+            if device.is_ready():
+                self.add_device(device)
+
+    def on_device_event(self, action, device):
+        if action == 'ready':
+            self.add_device(device)
+        elif action == 'remove':
+            self.remove_device(device)
+
+    def set_handler(self, handler, device = None):
+        if device is None:
+            self.default_handler = handler
+        else:
+            self.handlers[device.get_id()] = handler
+
+    def get_handler(self, device):
+        return self.handlers.get(device.get_id(), self.default_handler)
+
+    def get_devices(self):
+        with self.lock:
+            return list(self.devices.values())
+
+    def get_wakeups(self):
+        return self.wakeups
+
+    def add_device(self, device):
+        input_device = device.get_input_device()
+        if input_device is None or input_device.fd == -1:
+            return False
+        fd = input_device.fd
+        with self.lock:
+            self._remove_device(device)
+            # A closed fd leaves epoll on its own, any entry still using this number is stale
+            self.devices.pop(fd, None)
+            try:
+                self.epoll.register(fd, select.EPOLLIN)
+            except FileExistsError:
+                self.epoll.modify(fd, select.EPOLLIN)
+            self.devices[fd] = device
+        logging.debug("InputReactor: added %s (fd %d)", device.get_id(), fd)
+        return True
+
+    def remove_device(self, device):
+        with self.lock:
+            self._remove_device(device)
+
+    def _remove_device(self, device):
+        for fd, item in list(self.devices.items()):
+            if item is device:
+                del self.devices[fd]
+                try:
+                    self.epoll.unregister(fd)
+                except OSError:
+                    pass
+                logging.debug("InputReactor: removed %s (fd %d)", device.get_id(), fd)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self.run, daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        os.write(self.wakeup_write_fd, b'\0')
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while self.running:
+            ready = self.epoll.poll()
+            self.wakeups += 1
+            for fd, mask in ready:
+                if fd == self.wakeup_fd:
+                    try:
+                        os.read(self.wakeup_fd, 64)
+                    except BlockingIOError:
+                        pass
+                    continue
+                with self.lock:
+                    device = self.devices.get(fd)
+                if device is None:
+                    continue
+                if mask & select.EPOLLIN:
+                    handler = self.get_handler(device)
+                    try:
+                        for events in read_batches(device, mask & select.EPOLLHUP):
+                            if handler is not None:
+                                handler(device, events)
+                    except OSError as e:
+                        logging.debug(e)
+                        self.remove_device(device)
+                        continue
+                if mask & (select.EPOLLERR | select.EPOLLHUP):
+                    self.remove_device(device)
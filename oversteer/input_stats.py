@@ -0,0 +1,152 @@
+from evdev import ecodes
+import numpy as np
+import time
+
+class InputStats:
+
+    # Inter-event interval histogram bin edges in microseconds, bins are
+    # centered on the usual report periods (0.5, 0.75, 1, 1.25, 1.5, 2, 2.5, 3, 4, 5 ms...)
+    interval_edges = np.array([0, 375, 625, 875, 1125, 1375, 1750, 2250, 2750, 3500, 4500, 6000, 9000, 12500,
+        20000, 50000, 100000, np.iinfo(np.int64).max], dtype=np.int64)
+
+    # Batch sizes are counted in power of two bins: 1, 2-3, 4-7, ...
+    batch_bins = 16
+
+    def __init__(self):
+        self.interval_counts = np.zeros((ecodes.ABS_CNT, len(self.interval_edges) - 1), dtype=np.int64)
+        self.interval_sums = np.zeros(ecodes.ABS_CNT, dtype=np.float64)
+        self.interval_square_sums = np.zeros(ecodes.ABS_CNT, dtype=np.float64)
+        self.last_timestamps = np.zeros(ecodes.ABS_CNT, dtype=np.int64)
+        self.batch_counts = np.zeros(self.batch_bins, dtype=np.int64)
+        self.reads = 0
+        self.events = 0
+        self.syn_dropped = 0
+        # Reads and time spent with and without a kernel event mask
+        self.masked = False
+        self.mask_changed = time.monotonic()
+        self.mask_reads = [0, 0]
+        self.mask_durations = [0.0, 0.0]
+
+    def reset(self):
+        self.__init__()
+
+    def set_masked(self, masked):
+        now = time.monotonic()
+        self.mask_durations[self.masked] += now - self.mask_changed
+        self.mask_changed = now
+        self.masked = masked
+
+    def update_read(self, count):
+        self.reads += 1
+        self.mask_reads[self.masked] += 1
+        if count > 0:
+            self.batch_counts[min(int(count).bit_length() - 1, self.batch_bins - 1)] += 1
+
+    def update_batch(self, events):
+        self.update_read(len(events))
+        self.events += len(events)
+        self.syn_dropped += int(np.count_nonzero((events['type'] == ecodes.EV_SYN) &
+            (events['code'] == ecodes.SYN_DROPPED)))
+
+        events = events[events['type'] == ecodes.EV_ABS]
+        if len(events) == 0:
+            return
+
+        # Group events by axis keeping their order to compute intervals between consecutive events
+        order = np.argsort(events['code'], kind='stable')
+        codes = events['code'][order].astype(np.intp)
+        timestamps = events['sec'][order].astype(np.int64) * 1000000 + events['usec'][order]
+        group_start = np.ones(len(codes), dtype=bool)
+        group_start[1:] = codes[1:] != codes[:-1]
+        group_end = np.ones(len(codes), dtype=bool)
+        group_end[:-1] = group_start[1:]
+
+        previous = np.empty_like(timestamps)
+        previous[1:] = timestamps[:-1]
+        previous[group_start] = self.last_timestamps[codes[group_start]]
+        self.last_timestamps[codes[group_end]] = timestamps[group_end]
+
+        valid = previous != 0
+        self._add_intervals(codes[valid], timestamps[valid] - previous[valid])
+
+    def _add_intervals(self, codes, intervals):
+        bins = np.searchsorted(self.interval_edges, intervals, side='right') - 1
+        bins = np.clip(bins, 0, len(self.interval_edges) - 2)
+        np.add.at(self.interval_counts, (codes, bins), 1)
+        np.add.at(self.interval_sums, codes, intervals)
+        np.add.at(self.interval_square_sums, codes, intervals.astype(np.float64) ** 2)
+
+    def get_axis_report(self, code):
+        counts = self.interval_counts[code]
+        total = int(counts.sum())
+        if total == 0:
+            return None
+        mean = self.interval_sums[code] / total
+        variance = max(self.interval_square_sums[code] / total - mean ** 2, 0)
+        histogram = []
+        for index, count in enumerate(counts.tolist()):
+            if count:
+                histogram.append((int(self.interval_edges[index]), int(self.interval_edges[index + 1]), count))
+        return {
+            'count': total,
+            'mean_interval': mean,
+            'jitter': variance ** 0.5,
+            'rate': 1000000 / mean if mean > 0 else None,
+            'histogram': histogram,
+        }
+
+    def get_wakeup_report(self):
+        durations = list(self.mask_durations)
+        durations[self.masked] += time.monotonic() - self.mask_changed
+        rates = [reads / duration if duration > 0 else None for reads, duration in zip(self.mask_reads, durations)]
+        unmasked, masked = rates
+        reduction = None
+        if masked is not None and unmasked:
+            reduction = 1 - masked / unmasked
+        return {
+            'unmasked': unmasked,
+            'masked': masked,
+            'reduction': reduction,
+        }
+
+    def get_report(self):
+        axes = {}
+        for code in np.nonzero(self.interval_counts.sum(axis=1))[0].tolist():
+            axes[code] = self.get_axis_report(code)
+        batch_sizes = {}
+        for index, count in enumerate(self.batch_counts.tolist()):
+            if count:
+                batch_sizes[(1 << index, (2 << index) - 1)] = count
+        return {
+            'reads': self.reads,
+            'events': self.events,
+            'syn_dropped': self.syn_dropped,
+            'batch_sizes': batch_sizes,
+            'wakeups': self.get_wakeup_report(),
+            'axes': axes,
+        }
+
+    def format_report(self):
+        report = self.get_report()
+        lines = ["Reads: {}  Events: {}  SYN_DROPPED: {}".format(report['reads'], report['events'],
+            report['syn_dropped'])]
+        wakeups = report['wakeups']
+        for state in ('unmasked', 'masked'):
+            if wakeups[state] is not None:
+                lines.append("Wakeups {}: {:.1f}/s".format(state, wakeups[state]))
+        if wakeups['reduction'] is not None:
+            lines.append("Wakeups reduced by the event mask: {:.0%}".format(wakeups['reduction']))
+        if report['batch_sizes']:
+            lines.append("Batch sizes:")
+            for (low, high), count in report['batch_sizes'].items():
+                lines.append("  {:>4}-{:<4} {}".format(low, high, count))
+        for code, axis in report['axes'].items():
+            name = ecodes.ABS.get(code, code)
+            if isinstance(name, list):
+                name = name[0]
+            lines.append("{}: {} intervals, {:.1f} Hz, mean {:.0f} us, jitter {:.0f} us".format(name,
+                axis['count'], axis['rate'] or 0, axis['mean_interval'], axis['jitter']))
+            for low, high, count in axis['histogram']:
+                high = '' if high == self.interval_edges[-1] else high
+                lines.append("  {:>6}-{:<6} us {}".format(low, high, count))
+        return "\n".join(lines)
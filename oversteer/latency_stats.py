@@ -0,0 +1,54 @@
+import numpy as np
+
+class LatencyStats:
+
+    # Latencies are counted in fixed 100 us bins up to 100 ms by default, the last bin holds
+    # anything slower
+    bin_size = 0.0001
+    bin_count = 1001
+
+    def __init__(self, bin_size = bin_size, bin_count = bin_count):
+        self.bin_size = bin_size
+        self.bin_count = bin_count
+        self.counts = np.zeros(self.bin_count, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max_latency = 0.0
+
+    def reset(self):
+        self.__init__(self.bin_size, self.bin_count)
+
+    def record(self, latency):
+        if latency < 0:
+            latency = 0.0
+        self.counts[min(int(latency / self.bin_size), self.bin_count - 1)] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def get_percentile(self, percentile):
+        if self.count == 0:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), self.count * percentile / 100))
+        return min((index + 1) * self.bin_size, self.max_latency)
+
+    def get_report(self):
+        if self.count == 0:
+            return None
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'p50': self.get_percentile(50),
+            'p95': self.get_percentile(95),
+            'p99': self.get_percentile(99),
+            'max': self.max_latency,
+        }
+
+    def format_report(self):
+        report = self.get_report()
+        if report is None:
+            return "no samples"
+        return "{} samples, mean {:.2f} ms, p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+                report['count'], report['mean'] * 1000, report['p50'] * 1000, report['p95'] * 1000,
+                report['p99'] * 1000, report['max'] * 1000)
@@ -1,5 +1,6 @@
 import configparser
 import logging
+import time
 
 class Model:
 
@@ -21,6 +22,10 @@ class Model:
         'use_buttons': None,
         'center_wheel': None,
         'start_app_manually': None,
+        'steering_response': None,
+        'throttle_response': None,
+        'brakes_response': None,
+        'clutch_response': None,
     }
 
     types = {
@@ -38,22 +43,39 @@ class Model:
         'use_buttons': 'boolean',
         'center_wheel': 'boolean',
         'start_app_manually': 'boolean',
+        'steering_response': 'tuple',
+        'throttle_response': 'tuple',
+        'brakes_response': 'tuple',
+        'clutch_response': 'tuple',
     }
 
-    def __init__(self, device = None, ui = None):
+    response_axes = ['steering', 'throttle', 'brakes', 'clutch']
+
+    # Device settings in the order flush_device writes them, after the mode
+    flush_settings = ['range', 'combine_pedals', 'autocenter', 'ff_gain', 'spring_level', 'damper_level',
+            'friction_level', 'ffb_leds']
+
+    # Settings the device reports a default for when it has no sysfs attribute to read,
+    # with that attribute
+    reported_settings = {
+        'autocenter': 'autocenter',
+        'ff_gain': 'gain',
+    }
+
+    def __init__(self, device = None, ui = None, snapshot = None):
         self.ui = ui
         self.reference_values = None
         self.data = self.defaults.copy()
         if device != None:
-            self.set_device(device)
+            self.set_device(device, snapshot)
 
     def get_device(self):
         return self.device
 
-    def set_device(self, device):
+    def set_device(self, device, snapshot = None):
         self.device = device
         pending_data = self.data.copy()
-        self.update_from_device_settings()
+        self.update_from_device_settings(snapshot)
         for k, v in pending_data.items():
             if v != None:
                 self.data[k] = v
@@ -69,26 +91,33 @@ class Model:
             if self.data[key] != value:
                 self.ui.enable_save_profile()
 
-    def read_device_settings(self):
+    def read_device_settings(self, snapshot = None):
+        if snapshot is None:
+            snapshot = self.device.snapshot()
+        descriptor = self.device.get_descriptor()
         return {
-            'mode': self.device.get_mode(),
-            'range': self.device.get_range(),
-            'ff_gain': self.device.get_ff_gain(),
-            'autocenter': self.device.get_autocenter(),
-            'combine_pedals': self.device.get_combine_pedals(),
-            'spring_level': self.device.get_spring_level(),
-            'damper_level': self.device.get_damper_level(),
-            'friction_level': self.device.get_friction_level(),
-            'ffb_leds': self.device.get_ffb_leds(),
-            'ffb_overlay': False if self.device.get_peak_ffb_level() is not None else None,
-            'range_overlay': 'never' if self.device.get_peak_ffb_level() is not None else None,
-            'use_buttons': False if self.device.get_range() is not None else None,
+            'mode': snapshot.mode,
+            'range': snapshot.range,
+            'ff_gain': snapshot.ff_gain,
+            'autocenter': snapshot.autocenter,
+            'combine_pedals': snapshot.combine_pedals,
+            'spring_level': snapshot.spring_level,
+            'damper_level': snapshot.damper_level,
+            'friction_level': snapshot.friction_level,
+            'ffb_leds': snapshot.ffb_leds,
+            'ffb_overlay': False if descriptor.is_writable('peak_ffb_level') else None,
+            'range_overlay': 'never' if descriptor.is_writable('peak_ffb_level') else None,
+            'use_buttons': False if descriptor.is_writable('range') else None,
             'center_wheel': False,
             'start_app_manually': False,
+            'steering_response': self.device.get_axis_response('steering'),
+            'throttle_response': self.device.get_axis_response('throttle'),
+            'brakes_response': self.device.get_axis_response('brakes'),
+            'clutch_response': self.device.get_axis_response('clutch'),
         }
 
-    def update_from_device_settings(self):
-        self.data.update(self.read_device_settings())
+    def update_from_device_settings(self, snapshot = None):
+        self.data.update(self.read_device_settings(snapshot))
 
     def get_profile(self):
         return self.profile
@@ -164,7 +193,7 @@ class Model:
 
     def set_mode(self, value):
         if self.set_if_changed('mode', value):
-            self.device.set_mode(value)
+            return self.device.submit('mode', self.device.set_mode, value)
 
     def get_mode(self):
         return self.data['mode']
@@ -172,7 +201,7 @@ class Model:
     def set_range(self, value):
         value = int(value)
         if self.set_if_changed('range', value):
-            self.device.set_range(value)
+            return self.device.submit('range', self.device.set_range, value)
 
     def get_range(self):
         return self.data['range']
@@ -180,7 +209,7 @@ class Model:
     def set_ff_gain(self, value):
         value = int(value)
         if self.set_if_changed('ff_gain', value):
-            self.device.set_ff_gain(value)
+            return self.device.submit('ff_gain', self.device.set_ff_gain, value)
 
     def get_ff_gain(self):
         return self.data['ff_gain']
@@ -188,7 +217,7 @@ class Model:
     def set_autocenter(self, value):
         value = int(value)
         if self.set_if_changed('autocenter', value):
-            self.device.set_autocenter(value)
+            return self.device.submit('autocenter', self.device.set_autocenter, value)
 
     def get_autocenter(self):
         return self.data['autocenter']
@@ -196,7 +225,7 @@ class Model:
     def set_combine_pedals(self, value):
         value = int(value)
         if self.set_if_changed('combine_pedals', value):
-            self.device.set_combine_pedals(value)
+            return self.device.submit('combine_pedals', self.device.set_combine_pedals, value)
 
     def get_combine_pedals(self):
         return self.data['combine_pedals']
@@ -204,7 +233,7 @@ class Model:
     def set_spring_level(self, value):
         value = int(value)
         if self.set_if_changed('spring_level', value):
-            self.device.set_spring_level(value)
+            return self.device.submit('spring_level', self.device.set_spring_level, value)
 
     def get_spring_level(self):
         return self.data['spring_level']
@@ -212,7 +241,7 @@ class Model:
     def set_damper_level(self, value):
         value = int(value)
         if self.set_if_changed('damper_level', value):
-            self.device.set_damper_level(value)
+            return self.device.submit('damper_level', self.device.set_damper_level, value)
 
     def get_damper_level(self):
         return self.data['damper_level']
@@ -220,7 +249,7 @@ class Model:
     def set_friction_level(self, value):
         value = int(value)
         if self.set_if_changed('friction_level', value):
-            self.device.set_friction_level(value)
+            return self.device.submit('friction_level', self.device.set_friction_level, value)
 
     def get_friction_level(self):
         return self.data['friction_level']
@@ -228,7 +257,7 @@ class Model:
     def set_ffb_leds(self, value):
         value = bool(value)
         if self.set_if_changed('ffb_leds', value):
-            self.device.set_ffb_leds(1 if value else 0)
+            return self.device.submit('ffb_leds', self.device.set_ffb_leds, 1 if value else 0)
 
     def get_ffb_leds(self):
         return self.data['ffb_leds']
@@ -254,7 +283,7 @@ class Model:
     def set_center_wheel(self, value):
         value = bool(value)
         if self.set_if_changed('center_wheel', value) and value:
-            self.device.center_wheel()
+            return self.device.submit(None, self.device.center_wheel)
 
     def set_start_app_manually(self, value):
         value = bool(value)
@@ -263,28 +292,82 @@ class Model:
     def get_start_app_manually(self):
         return self.data['start_app_manually']
 
+    def get_axis_responses(self):
+        return {axis: self.data[axis + '_response'] for axis in self.response_axes}
+
+    def set_axis_response(self, axis, value):
+        if value is not None:
+            value = tuple(map(int, value))
+        if self.set_if_changed(axis + '_response', value):
+            self.device.set_axis_responses(self.get_axis_responses())
+
+    def get_axis_response(self, axis):
+        return self.data[axis + '_response']
+
+    def plan_flush(self, device, snapshot):
+        # Returns the (setting, value) writes that bring a device in the snapshot state to
+        # the model values, settings that can't be read back are always written
+        descriptor = device.get_descriptor()
+        plan = []
+        for key in self.flush_settings:
+            value = self.data[key]
+            if value is None:
+                continue
+            if key == 'ffb_leds':
+                value = int(value)
+            readable = key not in self.reported_settings or descriptor.is_writable(self.reported_settings[key])
+            if not readable or value != getattr(snapshot, key):
+                plan.append((key, value))
+        return plan
+
     def flush_device(self):
+        # Writes the settings that differ from the device and returns the time taken by
+        # each step
         logging.debug("flush_device")
-        if self.data['mode'] is not None:
-            self.device.set_mode(self.data['mode'])
-        if self.data['range'] is not None:
-            self.device.set_range(self.data['range'])
-        if self.data['combine_pedals'] is not None:
-            self.device.set_combine_pedals(self.data['combine_pedals'])
-        if self.data['center_wheel']:
-            self.device.center_wheel()
-        if self.data['autocenter'] is not None:
-            self.device.set_autocenter(self.data['autocenter'])
-        if self.data['ff_gain'] is not None:
-            self.device.set_ff_gain(self.data['ff_gain'])
-        if self.data['spring_level'] is not None:
-            self.device.set_spring_level(self.data['spring_level'])
-        if self.data['damper_level'] is not None:
-            self.device.set_damper_level(self.data['damper_level'])
-        if self.data['friction_level'] is not None:
-            self.device.set_friction_level(self.data['friction_level'])
-        if self.data['ffb_leds'] is not None:
-            self.device.set_ffb_leds(self.data['ffb_leds'])
+        # Let the queued writes land first so they don't overwrite the flushed values
+        self.device.wait_commands()
+        device = self.device
+        steps = []
+        start_time = time.monotonic()
+        snapshot = device.snapshot()
+        steps.append(('snapshot', time.monotonic() - start_time))
+
+        mode_changed = self.data['mode'] is not None and self.data['mode'] != snapshot.mode
+        if mode_changed:
+            start_time = time.monotonic()
+            ready = device.set_mode(self.data['mode'])
+            steps.append(('mode', time.monotonic() - start_time))
+            if not ready:
+                logging.warning("flush_device: %s not ready after the mode change", device.name)
+                return steps
+            # The other settings go to the device the wheel came back as
+            if device.get_successor() is not None:
+                device = device.get_successor()
+            start_time = time.monotonic()
+            snapshot = device.snapshot()
+            steps.append(('snapshot', time.monotonic() - start_time))
+
+        plan = self.plan_flush(device, snapshot)
+        for key, value in plan:
+            start_time = time.monotonic()
+            getattr(device, 'set_' + key)(value)
+            steps.append((key, time.monotonic() - start_time))
+
+        # Centering takes a second, it's only worth it when the wheel was reconfigured
+        if self.data['center_wheel'] and (mode_changed or plan):
+            start_time = time.monotonic()
+            device.center_wheel()
+            steps.append(('center_wheel', time.monotonic() - start_time))
+
+        responses = self.get_axis_responses()
+        if any(device.get_axis_response(axis) != response for axis, response in responses.items()):
+            start_time = time.monotonic()
+            device.set_axis_responses(responses)
+            steps.append(('axis_responses', time.monotonic() - start_time))
+
+        for step, seconds in steps:
+            logging.debug("flush_device %s: %.1f ms", step, seconds * 1000)
+        return steps
 
     def flush_ui(self, data = None):
         logging.debug("flush_ui")
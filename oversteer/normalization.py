@@ -0,0 +1,105 @@
+from evdev import ecodes
+import numpy as np
+from . import wheel_ids as wid
+
+def build_event_map(usb_id, vendor_id = None):
+    #
+    # Oversteer expects axes as follows:
+    #
+    # - Steering wheel direction: ABS_X [0, 65535]
+    # - Throttle: ABS_Z [0, 255]
+    # - Brakes: ABS_RZ [0, 255]
+    # - Clutch: ABS_Y [0, 255]
+    # - Hat X: ABS_HAT0X [-1, 1]
+    # - Hat Y: ABS_HAT0Y [-1, 1]
+    #
+    # Events are normalized through a (type, code) -> (code, scale, offset) map
+    # built once per device, so each event costs a single lookup. Arrays of
+    # events use the same map flattened into an EventTable.
+    #
+
+    if vendor_id is None and usb_id is not None:
+        vendor_id = usb_id.split(':')[0]
+
+    event_map = {}
+
+    def remap(event_type, code, new_code, scale = 1, offset = 0):
+        event_map[(event_type, code)] = (new_code, scale, offset)
+
+    if usb_id == wid.LG_WFF:
+        remap(ecodes.EV_KEY, ecodes.BTN_GEAR_DOWN, ecodes.BTN_TRIGGER)
+        remap(ecodes.EV_KEY, ecodes.BTN_GEAR_UP, ecodes.BTN_GEAR_UP - ecodes.BTN_GEAR_DOWN + ecodes.BTN_TRIGGER)
+        remap(ecodes.EV_ABS, ecodes.ABS_WHEEL, ecodes.ABS_X, 16, 2048 * 16)
+        remap(ecodes.EV_ABS, ecodes.ABS_GAS, ecodes.ABS_Z)
+        remap(ecodes.EV_ABS, ecodes.ABS_BRAKE, ecodes.ABS_RZ)
+
+    if usb_id in [wid.LG_WFG, wid.LG_WFFG]:
+        remap(ecodes.EV_ABS, ecodes.ABS_X, ecodes.ABS_X, 64)
+    elif usb_id in [wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP, wid.LG_DFGT, wid.LG_G25,
+            wid.LG_G27]:
+        remap(ecodes.EV_ABS, ecodes.ABS_X, ecodes.ABS_X, 4)
+    elif vendor_id == wid.VENDOR_CAMMUS:
+        remap(ecodes.EV_ABS, ecodes.ABS_X, ecodes.ABS_X, 1, 32768)
+    elif usb_id in [wid.TM_T80H]:
+        remap(ecodes.EV_ABS, ecodes.ABS_X, ecodes.ABS_X, 257)
+
+    if usb_id in [wid.LG_WFG, wid.LG_WFFG, wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP,
+            wid.LG_DFGT, wid.LG_G920]:
+        remap(ecodes.EV_ABS, ecodes.ABS_Y, ecodes.ABS_Z)
+        remap(ecodes.EV_ABS, ecodes.ABS_Z, ecodes.ABS_RZ)
+        remap(ecodes.EV_ABS, ecodes.ABS_RZ, ecodes.ABS_Y)
+    elif usb_id in [wid.TM_T248, wid.TM_T150, wid.TM_TMX]:
+        remap(ecodes.EV_ABS, ecodes.ABS_RZ, ecodes.ABS_Z)
+        remap(ecodes.EV_ABS, ecodes.ABS_Y, ecodes.ABS_RZ)
+        remap(ecodes.EV_ABS, ecodes.ABS_THROTTLE, ecodes.ABS_Y)
+    elif usb_id in [wid.TM_T80H]:
+        remap(ecodes.EV_ABS, ecodes.ABS_Y, ecodes.ABS_Z)
+        remap(ecodes.EV_ABS, ecodes.ABS_Z, ecodes.ABS_RZ)
+    elif vendor_id == wid.VENDOR_FANATEC:
+        for code in [ecodes.ABS_Y, ecodes.ABS_Z, ecodes.ABS_RZ]:
+            remap(ecodes.EV_ABS, code, code, 1, 32768 / 257)
+    elif usb_id in [wid.LG_GPRO_PS, wid.LG_GPRO_XBOX]:
+        remap(ecodes.EV_ABS, ecodes.ABS_RX, ecodes.ABS_Z, -1 / 257, 255)
+        remap(ecodes.EV_ABS, ecodes.ABS_RY, ecodes.ABS_RZ, -1 / 257, 255)
+        remap(ecodes.EV_ABS, ecodes.ABS_RZ, ecodes.ABS_Y, -1 / 257, 255)
+    elif usb_id == wid.LG_G923X:
+        remap(ecodes.EV_ABS, ecodes.ABS_Y, ecodes.ABS_Z)
+        remap(ecodes.EV_ABS, ecodes.ABS_RZ, ecodes.ABS_Y)
+        remap(ecodes.EV_ABS, ecodes.ABS_Z, ecodes.ABS_RZ)
+
+    return event_map
+
+class EventTable:
+
+    # The map as flat arrays indexed by type * KEY_CNT + code, codes that aren't
+    # remapped keep their code with a scale of 1 and no offset. Normalizing an
+    # array costs a few vectorized passes whatever the size of the map.
+    size = ecodes.EV_CNT * ecodes.KEY_CNT
+
+    def __init__(self, event_map):
+        self.codes = np.tile(np.arange(ecodes.KEY_CNT, dtype=np.uint16), ecodes.EV_CNT)
+        self.scales = np.ones(self.size, dtype=np.float64)
+        self.offsets = np.zeros(self.size, dtype=np.float64)
+        for (event_type, code), (new_code, scale, offset) in event_map.items():
+            index = event_type * ecodes.KEY_CNT + code
+            self.codes[index] = new_code
+            self.scales[index] = scale
+            self.offsets[index] = offset
+        self.identity = not event_map
+
+    def normalize(self, types, codes, values):
+        if self.identity or len(types) == 0:
+            return codes, values
+        # The kernel never reports codes over KEY_MAX, anything else fails the table lookup
+        index = types.astype(np.intp)
+        index *= ecodes.KEY_CNT
+        index += codes
+        new_values = values * self.scales[index]
+        new_values += self.offsets[index]
+        np.trunc(new_values, out=new_values)
+        return self.codes[index], new_values.astype(values.dtype)
+
+def normalize_events(events, usb_id, vendor_id = None):
+    # Returns the normalized codes and values of an array with type, code and value fields
+    table = EventTable(build_event_map(usb_id, vendor_id))
+    return table.normalize(events['type'], events['code'], events['value'])
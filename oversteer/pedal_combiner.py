@@ -0,0 +1,61 @@
+from evdev import ecodes
+import numpy as np
+
+class PedalCombiner:
+
+    # Pedal merged with the throttle for each combine_pedals mode
+    pedals = {
+        1: ecodes.ABS_RZ,
+        2: ecodes.ABS_Y,
+    }
+
+    # Value the merged pedal is left at, as the driver does
+    merged_value = 127
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.pedal = self.pedals[mode]
+        self.throttle_value = 255
+        self.pedal_value = 255
+
+    def get_mode(self):
+        return self.mode
+
+    def get_pedal(self):
+        return self.pedal
+
+    def combine_event(self, event):
+        # Both pedals are reported as a single throttle axis resting at the center
+        if event.type != ecodes.EV_ABS:
+            return event
+        if event.code == ecodes.ABS_Z:
+            self.throttle_value = event.value
+        elif event.code == self.pedal:
+            self.pedal_value = event.value
+            event.code = ecodes.ABS_Z
+        else:
+            return event
+        event.value = (255 + self.throttle_value - self.pedal_value) >> 1
+        return event
+
+    def combine_batch(self, events):
+        axis_events = events['type'] == ecodes.EV_ABS
+        throttle = axis_events & (events['code'] == ecodes.ABS_Z)
+        selected = np.flatnonzero(throttle | (axis_events & (events['code'] == self.pedal)))
+        if len(selected) == 0:
+            return events
+        throttle = throttle[selected]
+        values = events['value'][selected].astype(np.int64)
+
+        # Carry the last value of each pedal forward to the following events of the other one
+        positions = np.arange(len(selected))
+        last_throttle = np.maximum.accumulate(np.where(throttle, positions, -1))
+        last_pedal = np.maximum.accumulate(np.where(throttle, -1, positions))
+        throttle_values = np.where(last_throttle >= 0, values[last_throttle], self.throttle_value)
+        pedal_values = np.where(last_pedal >= 0, values[last_pedal], self.pedal_value)
+        self.throttle_value = int(throttle_values[-1])
+        self.pedal_value = int(pedal_values[-1])
+
+        events['code'][selected] = ecodes.ABS_Z
+        events['value'][selected] = (255 + throttle_values - pedal_values) >> 1
+        return events
@@ -0,0 +1,130 @@
+from evdev import ecodes
+import json
+import numpy as np
+import os
+import struct
+from threading import Lock
+from . import normalization
+
+#
+# Recording file format:
+#
+# - Magic: 8 bytes
+# - Header length: little endian uint32
+# - Header: JSON document padded with spaces so records start on a 64 bytes boundary
+# - Records: fixed size little endian records (record_dtype) until the end of the file
+#
+
+magic = b'OVSTREC\x01'
+
+record_dtype = np.dtype([
+    ('sec', '<i8'),
+    ('usec', '<i8'),
+    ('type', '<u2'),
+    ('code', '<u2'),
+    ('value', '<i4'),
+    ('normalized_code', '<u2'),
+    ('reserved', '<u2'),
+    ('normalized_value', '<i4'),
+])
+
+class Recorder:
+
+    def __init__(self, path, device):
+        self.path = path
+        self.lock = Lock()
+        self.count = 0
+        self.records = np.zeros(256, dtype=record_dtype)
+        self.pending = None
+        self.file = open(path, 'wb')
+        self.write_header(device)
+
+    def write_header(self, device):
+        absinfo = {}
+        input_device = device.get_input_device()
+        if input_device is not None:
+            for code, info in input_device.capabilities(absinfo=True).get(ecodes.EV_ABS, []):
+                absinfo[str(code)] = list(info)
+        header = json.dumps({
+            'usb_id': device.usb_id,
+            'vendor_id': device.vendor_id,
+            'product_id': device.product_id,
+            'name': device.name,
+            'max_range': device.get_max_range(),
+            'clock': 'monotonic',
+            'absinfo': absinfo,
+            'record_size': record_dtype.itemsize,
+        }).encode('utf-8')
+        length = len(magic) + 4 + len(header)
+        header += b' ' * (-length % 64)
+        self.file.write(magic + struct.pack('<I', len(header)) + header)
+
+    def get_path(self):
+        return self.path
+
+    def get_count(self):
+        return self.count
+
+    def begin_batch(self, events):
+        # Keep the raw values, the batch is normalized in place afterwards
+        if len(events) > len(self.records):
+            self.records = np.zeros(len(events), dtype=record_dtype)
+        records = self.records[:len(events)]
+        for field in ('sec', 'usec', 'type', 'code', 'value'):
+            records[field] = events[field]
+        self.pending = records
+
+    def end_batch(self, events):
+        records = self.pending
+        self.pending = None
+        records['normalized_code'] = events['code']
+        records['normalized_value'] = events['value']
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(records.data)
+            self.count += len(records)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class Recording:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(magic)) != magic:
+                raise ValueError("Not an Oversteer recording: " + path)
+            length, = struct.unpack('<I', file.read(4))
+            self.header = json.loads(file.read(length).decode('utf-8'))
+        self.offset = len(magic) + 4 + length
+        # Ignore a trailing partial record left by an interrupted recording
+        count = (os.path.getsize(path) - self.offset) // record_dtype.itemsize
+        if count > 0:
+            self.events = np.memmap(path, dtype=record_dtype, mode='r', offset=self.offset, shape=(count,))
+        else:
+            self.events = np.zeros(0, dtype=record_dtype)
+
+    def get_header(self):
+        return self.header
+
+    def get_absinfo(self):
+        return {int(code): info for code, info in self.header['absinfo'].items()}
+
+    def get_events(self):
+        return self.events
+
+    def get_raw_events(self):
+        return self.events[['sec', 'usec', 'type', 'code', 'value']]
+
+    def normalize(self, usb_id = None):
+        # Normalizes the raw events again, as another device would if usb_id is given
+        if usb_id is None:
+            return normalization.normalize_events(self.events, self.header['usb_id'], self.header['vendor_id'])
+        return normalization.normalize_events(self.events, usb_id)
+
+    def get_timestamps(self):
+        return self.events['sec'] + self.events['usec'] / 1000000
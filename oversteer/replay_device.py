@@ -0,0 +1,117 @@
+from evdev import ecodes, AbsInfo
+import logging
+import numpy as np
+import os
+from threading import Thread
+import time
+from .device import Device
+from .event_buffer import EventBuffer
+from .recorder import Recording
+
+class ReplayInput:
+
+    # Keep writes under PIPE_BUF so readers always get whole events
+    chunk_size = 128
+
+    def __init__(self, recording, speed):
+        self.recording = recording
+        self.speed = speed
+        self.running = True
+        self.path = recording.path
+        self.ff_effects_count = 0
+        self.fd, self.write_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+        self.thread = Thread(target=self.run, daemon = True)
+        self.thread.start()
+
+    def capabilities(self, absinfo = True):
+        axes = sorted(self.recording.get_absinfo().items())
+        if absinfo:
+            return {ecodes.EV_ABS: [(code, AbsInfo(*info)) for code, info in axes]}
+        return {ecodes.EV_ABS: [code for code, _ in axes]}
+
+    def absinfo(self, code):
+        return AbsInfo(*self.recording.get_absinfo()[code])
+
+    def write(self, event_type, code, value):
+        pass
+
+    def grab(self):
+        pass
+
+    def ungrab(self):
+        pass
+
+    def close(self):
+        self.running = False
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+    def run(self):
+        # Events keep their original spacing divided by the speed, shifted to start now.
+        # Speed 1 replays in real time, higher values replay faster, 0 replays as fast as
+        # possible with events stamped when they're written.
+        records = self.recording.get_raw_events()
+        buffer = np.zeros(self.chunk_size, dtype=EventBuffer.dtype)
+        start_time = time.monotonic()
+        if len(records) != 0:
+            first_timestamp = int(records[0]['sec']) * 1000000 + int(records[0]['usec'])
+        base_timestamp = EventBuffer.now_us()
+        position = 0
+        try:
+            while self.running and position < len(records):
+                chunk = records[position:position + self.chunk_size]
+                timestamps = chunk['sec'].astype(np.int64) * 1000000 + chunk['usec'] - first_timestamp
+                if self.speed > 0:
+                    elapsed = (time.monotonic() - start_time) * self.speed * 1000000
+                    due = int(np.searchsorted(timestamps, elapsed, side='right'))
+                    if due == 0:
+                        time.sleep(min((timestamps[0] - elapsed) / self.speed / 1000000, 0.1))
+                        continue
+                    chunk = chunk[:due]
+                    timestamps = timestamps[:due]
+                events = buffer[:len(chunk)]
+                if self.speed > 0:
+                    timestamps = (timestamps / self.speed).astype(np.int64) + base_timestamp
+                else:
+                    timestamps = np.full(len(chunk), EventBuffer.now_us(), dtype=np.int64)
+                events['sec'] = timestamps // 1000000
+                events['usec'] = timestamps % 1000000
+                events['type'] = chunk['type']
+                events['code'] = chunk['code']
+                events['value'] = chunk['value']
+                os.write(self.write_fd, events.tobytes())
+                position += len(chunk)
+        except OSError as e:
+            logging.debug(e)
+        os.close(self.write_fd)
+        logging.debug("Replay of %s finished after %d events", self.path, position)
+
+class ReplayDevice(Device):
+
+    def __init__(self, device_manager, path, speed = 1):
+        self.recording = Recording(path)
+        self.speed = speed
+        header = self.recording.get_header()
+        path = os.path.realpath(path)
+        super().__init__(device_manager, {
+            'id': 'replay:' + path,
+            'vendor_id': header['vendor_id'],
+            'product_id': header['product_id'],
+            'usb_id': header['usb_id'],
+            'dev_name': path,
+            'name': 'Replay: ' + header['name'],
+            'max_range': header['max_range'],
+        })
+
+    def checked_device_file(self, filename):
+        return False
+
+    def read_permissions(self):
+        return True
+
+    def get_input_device(self):
+        if self.input_device is None or self.input_device.fd == -1:
+            self.input_device = ReplayInput(self.recording, self.speed)
+        return self.input_device
@@ -0,0 +1,165 @@
+from evdev import ecodes
+import mmap
+import numpy as np
+import os
+import tempfile
+from threading import Lock
+import time
+from .event_buffer import EventBuffer
+
+#
+# Live telemetry shared memory layout (little endian):
+#
+# - magic: 8 bytes
+# - sequence: seqlock counter, odd while an update is in progress
+# - timestamp: time of the last update (seconds, CLOCK_MONOTONIC like the events)
+# - ffb_level: last peak FFB level read from the device, -1 if unknown
+# - axes: normalized value of every axis indexed by ABS_* code
+# - buttons: bitmap of pressed keys indexed by KEY_*/BTN_* code
+#
+# Readers copy the data and retry while the sequence is odd or has changed.
+#
+
+magic = b'OVSTTEL\x01'
+
+default_path = '/dev/shm/oversteer-telemetry'
+
+telemetry_dtype = np.dtype([
+    ('magic', 'S8'),
+    ('sequence', '<u8'),
+    ('timestamp', '<f8'),
+    ('ffb_level', '<i4'),
+    ('reserved', '<u4'),
+    ('axes', '<i4', (ecodes.ABS_CNT,)),
+    ('buttons', 'u1', ((ecodes.KEY_MAX + 1) // 8,)),
+])
+
+class TelemetryPublisher:
+
+    def __init__(self, path = default_path):
+        self.path = path
+        self.lock = Lock()
+        self.sequence = 0
+        self.keys = np.zeros(ecodes.KEY_MAX + 1, dtype=bool)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, telemetry_dtype.itemsize)
+            self.mmap = mmap.mmap(fd, telemetry_dtype.itemsize)
+        finally:
+            os.close(fd)
+        self.region = np.ndarray((), dtype=telemetry_dtype, buffer=self.mmap)
+        self.region['sequence'] = 0
+        self.region['ffb_level'] = -1
+        self.region['magic'] = magic
+
+    def get_path(self):
+        return self.path
+
+    def _begin(self):
+        self.sequence += 1
+        self.region['sequence'] = self.sequence
+
+    def _end(self, timestamp):
+        self.region['timestamp'] = timestamp
+        self.sequence += 1
+        self.region['sequence'] = self.sequence
+
+    def publish(self, axis_values, events):
+        keys = events[events['type'] == ecodes.EV_KEY]
+        with self.lock:
+            if self.mmap is None:
+                return
+            self._begin()
+            self.region['axes'] = axis_values
+            if len(keys) != 0:
+                # Only the last event of each key counts
+                keys = keys[::-1]
+                codes, indexes = np.unique(keys['code'], return_index=True)
+                self.keys[codes] = keys['value'][indexes] != 0
+                self.region['buttons'] = np.packbits(self.keys, bitorder='little')
+            self._end(EventBuffer.now())
+
+    def set_ffb_level(self, level):
+        with self.lock:
+            if self.mmap is None:
+                return
+            self._begin()
+            self.region['ffb_level'] = -1 if level is None else level
+            self._end(EventBuffer.now())
+
+    def close(self):
+        with self.lock:
+            if self.mmap is not None:
+                self.region = None
+                self.mmap.close()
+                self.mmap = None
+
+class TelemetryReader:
+
+    def __init__(self, path = default_path):
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), telemetry_dtype.itemsize, access=mmap.ACCESS_READ)
+        self.region = np.ndarray((), dtype=telemetry_dtype, buffer=self.mmap)
+        if bytes(self.region['magic']) != magic:
+            raise ValueError("Not an Oversteer telemetry region: " + path)
+
+    def read(self):
+        while True:
+            sequence = int(self.region['sequence'])
+            if sequence & 1:
+                continue
+            snapshot = self.region.copy()
+            if int(self.region['sequence']) == sequence:
+                return snapshot
+
+    def get_axis(self, snapshot, code):
+        return int(snapshot['axes'][code])
+
+    def is_pressed(self, snapshot, code):
+        return bool((snapshot['buttons'][code >> 3] >> (code & 7)) & 1)
+
+    def close(self):
+        self.region = None
+        self.mmap.close()
+
+def benchmark(count = 100000, batch_size = 8):
+    # Times publishing a region in a temporary file from event batches and single
+    # events, per event, and reading it back, per read
+    rng = np.random.default_rng(0)
+    events = np.zeros(count, dtype=EventBuffer.dtype)
+    events['type'] = rng.choice([ecodes.EV_ABS, ecodes.EV_KEY], count, p=[0.9, 0.1])
+    events['code'] = np.where(events['type'] == ecodes.EV_ABS,
+            rng.choice([ecodes.ABS_X, ecodes.ABS_Y, ecodes.ABS_Z, ecodes.ABS_RZ], count),
+            rng.choice([ecodes.BTN_TRIGGER, ecodes.BTN_THUMB, ecodes.BTN_TOP], count))
+    events['value'] = np.where(events['type'] == ecodes.EV_ABS, rng.integers(0, 65536, count),
+            rng.integers(0, 2, count))
+    axis_values = np.zeros(ecodes.ABS_CNT, dtype=np.int32)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        path = os.path.join(path, 'telemetry')
+        publisher = TelemetryPublisher(path)
+        reader = TelemetryReader(path)
+
+        start_time = time.perf_counter()
+        for start in range(0, count, batch_size):
+            publisher.publish(axis_values, events[start:start + batch_size])
+        results['publish'] = (time.perf_counter() - start_time) / count
+
+        start_time = time.perf_counter()
+        for start in range(count):
+            publisher.publish(axis_values, events[start:start + 1])
+        results['publish_single'] = (time.perf_counter() - start_time) / count
+
+        start_time = time.perf_counter()
+        for i in range(count):
+            reader.read()
+        results['read'] = (time.perf_counter() - start_time) / count
+
+        reader.close()
+        publisher.close()
+    return results
+
+if __name__ == '__main__':
+    for name, seconds in benchmark().items():
+        print("{}: {:.2f} us per {}".format(name, seconds * 1000000, 'read' if name == 'read' else 'event'))
@@ -2,6 +2,7 @@ from evdev import ecodes, ff
 import numpy as np
 from threading import Thread
 import time
+from .event_buffer import EventBuffer
 
 class Test:
 
@@ -35,6 +36,9 @@ class Test:
         self.input_values = []
         self.output_values = []
 
+        # Read every event while testing
+        self.device.set_event_interest('test', None)
+
         # Save wheel settings
         self.current_range = self.device.get_range()
         self.current_ff_gain = self.device.get_ff_gain()
@@ -42,7 +46,7 @@ class Test:
 
         # Prepare wheel
         try:
-            for effect_id in range(self.input_device.ff_effects_count):
+            for effect_id in range(self.device.get_descriptor().ff_effects_count):
                 self.input_device.erase_effect(effect_id)
         except OSError:
             pass
@@ -91,18 +95,16 @@ class Test:
         elif test_id == 2:
             Thread(target=self.test3,).start()
 
-    def append_data(self, timestamp, value):
+    def append_batch(self, events):
         if self.collecting_data is False:
             return
-        self.output_values.append((timestamp - self.test_starttime, (value - 32768) / 32768))
+        events = events[(events['type'] == ecodes.EV_ABS) & (events['code'] == ecodes.ABS_X)]
+        timestamps = (EventBuffer.timestamps_us(events) - self.test_starttime) / 1000000
+        values = (events['value'] - 32768) / 32768
+        self.output_values.extend(zip(timestamps.tolist(), values.tolist()))
 
-    def seed_axis_position(self):
-        # Move the wheel a bit to start collecting data
-        effect = self.create_left_effect(0x2000)
-        self.input_device.write(ecodes.EV_FF, effect.id, 1)
-        time.sleep(0.1)
-        self.input_device.write(ecodes.EV_FF, effect.id, 0)
-        self.erase_effect(effect)
+    def elapsed_time(self):
+        return (EventBuffer.now_us() - self.test_starttime) / 1000000
 
     def center_wheel(self):
         # Center wheel
@@ -154,13 +156,15 @@ class Test:
         self.awaiting_action = False
         self.stop()
 
+        self.device.clear_event_interest('test')
+
         # Notify application the test is done
         self.notify()
 
     def test2(self):
         self.start()
-        self.seed_axis_position()
         self.center_wheel()
+        self.device.sync_axis_state()
 
         left_effect = self.create_left_effect(0)
         right_effect = self.create_right_effect(0)
@@ -169,7 +173,8 @@ class Test:
         starting_wheel_pos = (self.device.get_last_axis_value(ecodes.ABS_X) - 32768) / 32768
         self.input_values = [(0, 0)]
         self.output_values = [(0, starting_wheel_pos)]
-        self.test_starttime = time.time()
+        # Times are kept in integer microseconds of the events clock
+        self.test_starttime = EventBuffer.now_us()
         time.sleep(0.1)
 
         # Start collecting data
@@ -184,7 +189,7 @@ class Test:
                 right_effect.u.ff_constant_effect.level = level
                 self.update_effect(right_effect)
                 self.input_device.write(ecodes.EV_FF, right_effect.id, 1)
-                self.input_values.append((time.time() - self.test_starttime, level / 0x7fff))
+                self.input_values.append((self.elapsed_time(), level / 0x7fff))
                 time.sleep(0.3)
                 self.input_device.write(ecodes.EV_FF, right_effect.id, 0)
             else:
@@ -192,12 +197,12 @@ class Test:
                 left_effect.u.ff_constant_effect.level = level
                 self.update_effect(left_effect)
                 self.input_device.write(ecodes.EV_FF, left_effect.id, 1)
-                self.input_values.append((time.time() - self.test_starttime, -level / 0x7fff))
+                self.input_values.append((self.elapsed_time(), -level / 0x7fff))
                 time.sleep(0.3)
                 self.input_device.write(ecodes.EV_FF, left_effect.id, 0)
             direction = 3 - direction
 
-        self.input_values.append((time.time() - self.test_starttime, 0))
+        self.input_values.append((self.elapsed_time(), 0))
 
         # Stop collecting data
         self.collecting_data = False
@@ -205,13 +210,15 @@ class Test:
         self.erase_effect(left_effect)
         self.erase_effect(right_effect)
 
+        self.device.clear_event_interest('test')
+
         # Notify application the test is done
         self.notify()
 
     def test3(self):
         self.start()
-        self.seed_axis_position()
         self.center_wheel()
+        self.device.sync_axis_state()
 
         left_effect = self.create_left_effect()
         right_effect = self.create_right_effect()
@@ -220,34 +227,35 @@ class Test:
         starting_wheel_pos = (self.device.get_last_axis_value(ecodes.ABS_X) - 32768) / 32768
         self.input_values = [(0, 0)]
         self.output_values = [(0, starting_wheel_pos)]
-        self.test_starttime = time.time()
+        # Times are kept in integer microseconds of the events clock
+        self.test_starttime = EventBuffer.now_us()
         time.sleep(0.1)
 
         # Start collecting data
         self.collecting_data = True
 
         # Move wheel right at top speed
-        self.input_values.append((time.time() - self.test_starttime, 1))
+        self.input_values.append((self.elapsed_time(), 1))
         self.input_device.write(ecodes.EV_FF, right_effect.id, 1)
         time.sleep(0.3)
         self.input_device.write(ecodes.EV_FF, right_effect.id, 0)
 
         # Move wheel left at top speed
-        self.input_values.append((time.time() - self.test_starttime, -1))
+        self.input_values.append((self.elapsed_time(), -1))
         self.input_device.write(ecodes.EV_FF, left_effect.id, 1)
         time.sleep(0.3)
         self.input_device.write(ecodes.EV_FF, left_effect.id, 0)
 
         # Move wheel right at top speed
-        self.input_values.append((time.time() - self.test_starttime, 1))
+        self.input_values.append((self.elapsed_time(), 1))
         self.input_device.write(ecodes.EV_FF, right_effect.id, 1)
         time.sleep(0.3)
         self.input_device.write(ecodes.EV_FF, right_effect.id, 0)
-        self.input_values.append((time.time() - self.test_starttime, 0))
+        self.input_values.append((self.elapsed_time(), 0))
 
         # Keep collecting deceleration data
         time.sleep(0.5)
-        self.input_values.append((time.time() - self.test_starttime, 0))
+        self.input_values.append((self.elapsed_time(), 0))
 
         # Stop collecting data
         self.collecting_data = False
@@ -255,5 +263,7 @@ class Test:
         self.erase_effect(left_effect)
         self.erase_effect(right_effect)
 
+        self.device.clear_event_interest('test')
+
         # Notify application the test is done
         self.notify()
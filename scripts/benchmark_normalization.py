@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Checks the per-event map and the EventTable of oversteer.normalization against
+# the if/elif normalization they replaced, for every wheel id, and compares their
+# throughput. Run from the source tree: scripts/benchmark_normalization.py
+#
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from evdev import ecodes
+import numpy as np
+from oversteer.event_buffer import EventBuffer
+from oversteer import normalization
+from oversteer import wheel_ids as wid
+
+def reference_normalize(usb_id, vendor_id, event_type, code, value):
+    # The per-event logic the map replaced, kept to check the map against it
+    if event_type == ecodes.EV_KEY:
+        if usb_id in [wid.LG_WFF]:
+            if code in [ecodes.BTN_GEAR_DOWN, ecodes.BTN_GEAR_UP]:
+                code = code - ecodes.BTN_GEAR_DOWN + ecodes.BTN_TRIGGER
+
+    if event_type != ecodes.EV_ABS:
+        return code, value
+
+    if usb_id in [wid.LG_WFF]:
+        if code == ecodes.ABS_WHEEL:
+            code = ecodes.ABS_X
+            value = (value + 2048) * 16
+        elif code == ecodes.ABS_GAS:
+            code = ecodes.ABS_Z
+        elif code == ecodes.ABS_BRAKE:
+            code = ecodes.ABS_RZ
+    if code == ecodes.ABS_X:
+        if usb_id in [wid.LG_WFG, wid.LG_WFFG]:
+            value = value * 64
+        elif usb_id in [wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP, wid.LG_DFGT, wid.LG_G25,
+                wid.LG_G27]:
+            value = value * 4
+        elif vendor_id == wid.VENDOR_CAMMUS:
+            value = value + 32768
+        elif usb_id in [wid.TM_T80H]:
+            value = value * 257
+    elif usb_id in [wid.LG_WFG, wid.LG_WFFG, wid.LG_SFW, wid.LG_MOMO, wid.LG_MOMO2, wid.LG_DF, wid.LG_DFP,
+            wid.LG_DFGT, wid.LG_G920]:
+        if code == ecodes.ABS_Y:
+            code = ecodes.ABS_Z
+        elif code == ecodes.ABS_Z:
+            code = ecodes.ABS_RZ
+        elif code == ecodes.ABS_RZ:
+            code = ecodes.ABS_Y
+    elif usb_id in [wid.TM_T248, wid.TM_T150, wid.TM_TMX]:
+        if code == ecodes.ABS_RZ:
+            code = ecodes.ABS_Z
+        elif code == ecodes.ABS_Y:
+            code = ecodes.ABS_RZ
+        elif code == ecodes.ABS_THROTTLE:
+            code = ecodes.ABS_Y
+    elif usb_id in [wid.TM_T80H]:
+        if code == ecodes.ABS_Y:
+            code = ecodes.ABS_Z
+        elif code == ecodes.ABS_Z:
+            code = ecodes.ABS_RZ
+    elif vendor_id == wid.VENDOR_FANATEC and code in [ecodes.ABS_Y, ecodes.ABS_Z, ecodes.ABS_RZ]:
+        value = int(value + 32768 / 257)
+    elif usb_id in [wid.LG_GPRO_PS, wid.LG_GPRO_XBOX]:
+        if code in [ecodes.ABS_RX, ecodes.ABS_RY, ecodes.ABS_RZ]:
+            value = int(255 - value / 257)
+            if code == ecodes.ABS_RX:
+                code = ecodes.ABS_Z
+            elif code == ecodes.ABS_RY:
+                code = ecodes.ABS_RZ
+            elif code == ecodes.ABS_RZ:
+                code = ecodes.ABS_Y
+    elif usb_id == wid.LG_G923X:
+        if code == ecodes.ABS_Y:
+            code = ecodes.ABS_Z
+        elif code == ecodes.ABS_RZ:
+            code = ecodes.ABS_Y
+        elif code == ecodes.ABS_Z:
+            code = ecodes.ABS_RZ
+    return code, value
+
+def benchmark(count = 100000):
+    # Normalizes the same random events for every wheel id with the reference logic, the
+    # per-event map and the EventTable, and counts the events where they disagree
+    rng = np.random.default_rng(0)
+    events = np.zeros(count, dtype=EventBuffer.dtype)
+    events['type'] = rng.choice([ecodes.EV_SYN, ecodes.EV_KEY, ecodes.EV_ABS, ecodes.EV_MSC], count,
+            p=[0.2, 0.1, 0.6, 0.1])
+    key_codes = [ecodes.BTN_TRIGGER, ecodes.BTN_GEAR_DOWN, ecodes.BTN_GEAR_UP, ecodes.BTN_TRIGGER_HAPPY1]
+    events['code'] = np.where(events['type'] == ecodes.EV_KEY, rng.choice(key_codes, count),
+            rng.integers(0, ecodes.ABS_CNT, count))
+    events['value'] = rng.integers(-32768, 65536, count)
+    samples = [(int(event_type), int(code), int(value))
+            for event_type, code, value in zip(events['type'], events['code'], events['value'])]
+
+    usb_ids = sorted(value for name, value in vars(wid).items() if not name.startswith('VENDOR_') and
+            isinstance(value, str) and ':' in value)
+    results = {}
+    for usb_id in usb_ids:
+        vendor_id = usb_id.split(':')[0]
+        event_map = normalization.build_event_map(usb_id, vendor_id)
+
+        start_time = time.perf_counter()
+        expected = [reference_normalize(usb_id, vendor_id, *sample) for sample in samples]
+        reference_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        mapped = []
+        for event_type, code, value in samples:
+            transform = event_map.get((event_type, code))
+            if transform is not None:
+                new_code, scale, offset = transform
+                mapped.append((new_code, int(value * scale + offset)))
+            else:
+                mapped.append((code, value))
+        map_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        table = normalization.EventTable(event_map)
+        codes, values = table.normalize(events['type'], events['code'], events['value'])
+        table_time = time.perf_counter() - start_time
+
+        results[usb_id] = {
+            'reference': count / reference_time,
+            'map': count / map_time,
+            'table': count / table_time,
+            'map_mismatches': sum(1 for a, b in zip(expected, mapped) if a != b),
+            'table_mismatches': sum(1 for a, b in zip(expected, zip(codes.tolist(), values.tolist())) if a != b),
+        }
+    return results
+
+if __name__ == '__main__':
+    print("{:<10} {:>14} {:>14} {:>14} {:>10}".format("wheel", "reference/s", "map/s", "table/s", "mismatches"))
+    for usb_id, result in benchmark().items():
+        print("{:<10} {:>14.0f} {:>14.0f} {:>14.0f} {:>10}".format(usb_id, result['reference'], result['map'],
+                result['table'], result['map_mismatches'] + result['table_mismatches']))